@@ -22,13 +22,85 @@ Ejemplos:
 """
 
 import cv2
+import functools
 import numpy as np
 from rembg import remove, new_session
 from PIL import Image
 import sys
 import os
 import io
-from scipy import ndimage
+
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+if NUMBA_AVAILABLE:
+    # Firmas explícitas + cache: compilan en el import y los
+    # relanzamientos del CLI cargan el código máquina del disco
+    @njit('i8[:](u1[:,:,:], u1[:,:])', cache=True)
+    def _luminosity_histogram(rgb, alpha):
+        # Histograma de 256 bins de la luminosidad de los píxeles
+        # visibles: el percentil sale del acumulado sin ordenar ni
+        # materializar el array float de luminosidad completo
+        hist = np.zeros(256, np.int64)
+        H, W = alpha.shape
+        for y in range(H):
+            for x in range(W):
+                if alpha[y, x] > 0:
+                    l = (0.299 * rgb[y, x, 0] + 0.587 * rgb[y, x, 1]
+                         + 0.114 * rgb[y, x, 2])
+                    hist[int(l)] += 1
+        return hist
+
+    @njit('void(u1[:,:,:], u1[:,:], f4)', parallel=True, fastmath=True,
+          cache=True)
+    def _white_kill(rgb, alpha, threshold):
+        # Luminosidad + umbral + escritura del alfa fusionados en una
+        # pasada paralela por filas
+        H, W = alpha.shape
+        for y in prange(H):
+            for x in range(W):
+                if alpha[y, x] > 0:
+                    l = (0.299 * rgb[y, x, 0] + 0.587 * rgb[y, x, 1]
+                         + 0.114 * rgb[y, x, 2])
+                    if l > threshold:
+                        alpha[y, x] = 0
+
+
+def _preferred_providers():
+    """Providers acelerados que la build de onnxruntime trae de verdad:
+    CUDA en Linux/Windows con GPU NVIDIA, CoreML en macOS, DirectML en
+    Windows. El forward de U²Net/ISNet domina el tiempo total, así que
+    moverlo a GPU es la mayor ganancia disponible."""
+    try:
+        import onnxruntime as ort
+        available = ort.get_available_providers()
+    except ImportError:
+        return None
+    preferred = [p for p in ('CUDAExecutionProvider',
+                             'CoreMLExecutionProvider',
+                             'DmlExecutionProvider')
+                 if p in available]
+    if not preferred:
+        return None
+    return preferred + ['CPUExecutionProvider']
+
+
+# Cachear la sesión ONNX: new_session recarga el modelo (cientos de MB)
+# e inicializa el grafo en cada llamada, el coste dominante al procesar
+# varias imágenes en el mismo proceso
+@functools.lru_cache(maxsize=4)
+def _get_session(model_name):
+    providers = _preferred_providers()
+    if providers:
+        try:
+            return new_session(model_name, providers=providers)
+        except Exception:
+            pass
+    return new_session(model_name)
 
 
 def remove_background_isnet(input_path, output_path, verbose=False):
@@ -55,7 +127,7 @@ def remove_background_isnet(input_path, output_path, verbose=False):
         # Crear sesión ISNet
         if verbose:
             print("🤖 Inicializando modelo ISNet-General-Use...")
-        session = new_session('isnet-general-use')
+        session = _get_session('isnet-general-use')
         
         # Cargar y procesar imagen
         with open(input_path, 'rb') as input_file:
@@ -81,7 +153,9 @@ def remove_background_isnet(input_path, output_path, verbose=False):
             percentage = (visible_pixels / original_pixels) * 100
             print(f"📊 Píxeles capturados: {percentage:.1f}% ({visible_pixels:,}/{original_pixels:,})")
         
-        # Conectar componentes pequeños al componente principal
+        # Conectar componentes pequeños al componente principal. Las tres
+        # etapas siguientes mutan el plano alfa in place: sin las tres
+        # copias RGBA completas que hacía cada función
         if verbose:
             print("🔗 Conectando componentes...")
         result_array = connect_components(result_array)
@@ -110,60 +184,69 @@ def remove_background_isnet(input_path, output_path, verbose=False):
         return False
 
 
-def connect_components(img_array):
+def connect_components(img_array, inplace=True):
     """Conecta componentes pequeños al componente principal."""
-    alpha = img_array[:,:,3]
-    
-    # Encontrar componentes conectados
+    result = img_array if inplace else img_array.copy()
+    alpha = result[:,:,3]
+
+    # Encontrar componentes conectados. WithStats devuelve el área de
+    # cada componente en la misma pasada, en vez de un
+    # np.sum(labels == i) por etiqueta (O(N·K) sobre la imagen completa)
     binary = (alpha > 0).astype(np.uint8)
-    num_labels, labels = cv2.connectedComponents(binary)
-    
+    num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(
+        binary, connectivity=8)
+
     if num_labels <= 2:  # Solo fondo + un componente
-        return img_array
-    
-    # Encontrar el componente más grande (excluyendo el fondo)
-    component_sizes = []
-    for i in range(1, num_labels):
-        size = np.sum(labels == i)
-        component_sizes.append((size, i))
-    
-    # Ordenar por tamaño
-    component_sizes.sort(reverse=True)
-    main_component_label = component_sizes[0][1]
-    
-    # Crear kernel para dilatación
-    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
-    
+        return result
+
+    # El componente más grande (excluyendo el fondo)
+    sizes = stats[1:, cv2.CC_STAT_AREA]
+    main_component_label = 1 + int(np.argmax(sizes))
+
     # Expandir componente principal
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
     main_mask = (labels == main_component_label).astype(np.uint8)
     expanded_main = cv2.dilate(main_mask, kernel, iterations=2)
-    
-    # Conectar componentes pequeños que estén cerca
-    for size, label in component_sizes[1:]:
-        if size < 1000:  # Solo componentes pequeños
-            component_mask = (labels == label).astype(np.uint8)
-            # Si hay intersección después de la dilatación, incluir
-            if np.any(expanded_main & component_mask):
-                main_mask = main_mask | component_mask
-    
-    # Aplicar la máscara conectada
-    result = img_array.copy()
-    alpha_connected = alpha * main_mask
-    result[:,:,3] = alpha_connected
-    
+
+    # Conectar componentes pequeños que estén cerca: las etiquetas bajo
+    # la dilatación salen de un único recorrido vectorizado del plano,
+    # sin comparar labels == i por componente en Python
+    touching = np.unique(labels[expanded_main.astype(bool)])
+    touching = touching[(touching != 0) & (touching != main_component_label)]
+    small_touching = touching[sizes[touching - 1] < 1000]
+    if small_touching.size:
+        main_mask = (main_mask.astype(bool)
+                     | np.isin(labels, small_touching)).astype(np.uint8)
+
+    # Aplicar la máscara conectada sobre el propio plano alfa
+    result[:,:,3] = alpha * main_mask
+
     return result
 
 
-def remove_white_pixels(img_array):
+def remove_white_pixels(img_array, inplace=True):
     """Elimina píxeles blancos o casi blancos del resultado."""
-    result = img_array.copy()
+    result = img_array if inplace else img_array.copy()
     alpha = result[:,:,3]
-    
+
+    if NUMBA_AVAILABLE:
+        rgb = result[:,:,:3]
+        hist = _luminosity_histogram(rgb, alpha)
+        visible = int(hist.sum())
+        if visible == 0:
+            return result
+        # Percentil 95 por búsqueda en el acumulado del histograma
+        cum = np.cumsum(hist)
+        threshold = float(np.searchsorted(cum, 0.95 * visible))
+        threshold = max(threshold, 240.0)  # Mínimo conservador
+        _white_kill(rgb, alpha, np.float32(threshold))
+        return result
+
     # Solo procesar píxeles visibles
     visible_mask = alpha > 0
     if not np.any(visible_mask):
         return result
-    
+
     # Calcular luminosidad para píxeles visibles
     rgb = result[:,:,:3]
     luminosity = np.zeros_like(alpha, dtype=np.float32)
@@ -182,9 +265,9 @@ def remove_white_pixels(img_array):
     return result
 
 
-def smooth_edges(img_array):
+def smooth_edges(img_array, inplace=True):
     """Aplica suavizado suave a los bordes para evitar dentado."""
-    result = img_array.copy()
+    result = img_array if inplace else img_array.copy()
     alpha = result[:,:,3].astype(np.float32)
     
     # Aplicar Gaussian blur muy suave solo al canal alfa
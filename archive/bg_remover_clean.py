@@ -26,7 +26,12 @@ from PIL import Image
 import sys
 import os
 import io
-from scipy import ndimage
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
 
 
 def remove_background_clean(input_path, output_path, alpha_threshold=150, verbose=False):
@@ -75,9 +80,9 @@ def remove_background_clean(input_path, output_path, alpha_threshold=150, verbos
         
         if verbose:
             # Calcular estadísticas iniciales
-            original_pixels = img_array.shape[0] * img_array.shape[1]
-            alpha_channel = result_array[:,:,3] 
-            visible_pixels_initial = np.sum(alpha_channel > 0)
+            alpha_channel = result_array[:,:,3]
+            original_pixels = alpha_channel.size
+            visible_pixels_initial = int(np.count_nonzero(alpha_channel))
             percentage_initial = (visible_pixels_initial / original_pixels) * 100
             print(f"📊 Píxeles iniciales: {percentage_initial:.1f}% ({visible_pixels_initial:,}/{original_pixels:,})")
         
@@ -104,7 +109,7 @@ def remove_background_clean(input_path, output_path, alpha_threshold=150, verbos
         # Estadísticas finales
         if verbose:
             alpha_final = result_array[:,:,3]
-            visible_final = np.sum(alpha_final > 0)
+            visible_final = int(np.count_nonzero(alpha_final))
             percentage_final = (visible_final / original_pixels) * 100
             reduction = percentage_initial - percentage_final
             print(f"📈 Píxeles finales: {percentage_final:.1f}% ({visible_final:,}/{original_pixels:,})")
@@ -124,88 +129,96 @@ def remove_background_clean(input_path, output_path, alpha_threshold=150, verbos
         return False
 
 
-def clean_partial_transparencies(img_array, threshold, verbose=False):
+if NUMBA_AVAILABLE:
+    @njit(parallel=True, cache=True)
+    def _clean_alpha_kernel(alpha, threshold):
+        # Fusiona el cero-parciales y la saturación de sólidos en una sola pasada
+        H, W = alpha.shape
+        for y in prange(H):
+            for x in range(W):
+                alpha[y, x] = 0 if alpha[y, x] < threshold else 255
+
+def clean_partial_transparencies(img_array, threshold, verbose=False, inplace=True):
     """
     Elimina transparencias parciales que causan objetos semi-transparentes no deseados.
+
+    Con inplace=True (el modo del pipeline) muta img_array directamente y
+    evita copiar el buffer RGBA completo.
     """
-    result = img_array.copy()
+    result = img_array if inplace else img_array.copy()
     alpha = result[:,:,3]
-    
+
     # Contar píxeles en diferentes rangos de transparencia
     if verbose:
-        total_pixels = alpha.shape[0] * alpha.shape[1]
-        transparent = np.sum(alpha == 0)
-        partial = np.sum((alpha > 0) & (alpha < threshold))
-        solid = np.sum(alpha >= threshold)
-        
+        total_pixels = alpha.size
+        # Un solo histograma en vez de tres barridos booleanos
+        hist = np.bincount(alpha.ravel(), minlength=256)
+        transparent = int(hist[0])
+        partial = int(hist[1:threshold].sum())
+        solid = int(hist[threshold:].sum())
+
         print(f"   🔍 Análisis alpha:")
         print(f"   - Transparente (0): {(transparent/total_pixels)*100:.1f}%")
         print(f"   - Parcial (1-{threshold-1}): {(partial/total_pixels)*100:.1f}% ← PROBLEMA")
         print(f"   - Sólido ({threshold}+): {(solid/total_pixels)*100:.1f}%")
-    
-    # Eliminar píxeles con transparencia parcial problemática
-    # Estos suelen ser objetos como globos, relojes, etc. que el modelo ve como "dudosos"
-    problematic_mask = (alpha > 0) & (alpha < threshold)
-    result[problematic_mask, 3] = 0  # Hacer completamente transparentes
-    
-    # Para píxeles que están por encima del umbral, asegurar que sean completamente opacos
-    solid_mask = alpha >= threshold
-    result[solid_mask, 3] = 255
-    
+
+    if NUMBA_AVAILABLE:
+        _clean_alpha_kernel(alpha, threshold)
+    else:
+        # Eliminar píxeles con transparencia parcial problemática
+        # Estos suelen ser objetos como globos, relojes, etc. que el modelo ve como "dudosos"
+        problematic_mask = (alpha > 0) & (alpha < threshold)
+        result[problematic_mask, 3] = 0  # Hacer completamente transparentes
+
+        # Para píxeles que están por encima del umbral, asegurar que sean completamente opacos
+        solid_mask = alpha >= threshold
+        result[solid_mask, 3] = 255
+
     if verbose:
-        eliminated = np.sum(problematic_mask)
-        print(f"   ❌ Eliminados {eliminated:,} píxeles semi-transparentes")
-    
+        print(f"   ❌ Eliminados {partial:,} píxeles semi-transparentes")
+
     return result
 
 
-def connect_main_components(img_array, verbose=False):
+def connect_main_components(img_array, verbose=False, inplace=True):
     """
     Conecta solo los componentes principales, eliminando fragmentos pequeños.
     """
     alpha = img_array[:,:,3]
-    
-    # Encontrar componentes conectados
+
+    # Encontrar componentes conectados con sus tamaños en una sola pasada C++
     binary = (alpha > 0).astype(np.uint8)
-    num_labels, labels = cv2.connectedComponents(binary)
-    
+    num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+
     if num_labels <= 2:  # Solo fondo + un componente
         return img_array
-    
-    # Analizar tamaños de componentes
-    component_sizes = []
-    for i in range(1, num_labels):
-        size = np.sum(labels == i)
-        component_sizes.append((size, i))
-    
-    # Ordenar por tamaño
-    component_sizes.sort(reverse=True)
-    
+
+    # Tamaños de componentes (la etiqueta 0 es el fondo)
+    sizes = stats[1:, cv2.CC_STAT_AREA]
+    order = np.argsort(sizes)[::-1]
+
     if verbose:
+        total_pixels = alpha.size
         print(f"   🔍 Encontrados {num_labels-1} componentes:")
-        for i, (size, label) in enumerate(component_sizes[:5]):  # Mostrar top 5
-            percentage = (size / (alpha.shape[0] * alpha.shape[1])) * 100
-            print(f"   - Componente {i+1}: {size:,} píxeles ({percentage:.2f}%)")
-    
+        for i, idx in enumerate(order[:5]):  # Mostrar top 5
+            percentage = (sizes[idx] / total_pixels) * 100
+            print(f"   - Componente {i+1}: {sizes[idx]:,} píxeles ({percentage:.2f}%)")
+
     # Mantener solo componentes principales (>1% del total)
-    total_pixels = alpha.shape[0] * alpha.shape[1]
-    main_components = []
-    
-    for size, label in component_sizes:
-        percentage = (size / total_pixels) * 100
-        if percentage >= 1.0:  # Componentes >= 1% del total
-            main_components.append(label)
-        elif len(main_components) == 0:  # Siempre mantener al menos el más grande
-            main_components.append(label)
-    
-    # Crear máscara solo con componentes principales
-    main_mask = np.zeros_like(alpha, dtype=np.uint8)
-    for label in main_components:
-        main_mask[labels == label] = 1
-    
+    total_pixels = alpha.size
+    keep_ids = np.where(sizes >= 0.01 * total_pixels)[0] + 1
+    if len(keep_ids) == 0:  # Siempre mantener al menos el más grande
+        keep_ids = np.array([order[0] + 1])
+
+    # Tabla de búsqueda etiqueta → mantener: un solo gather, sin bucle Python
+    keep = np.zeros(num_labels, dtype=np.uint8)
+    keep[keep_ids] = 1
+    main_mask = keep[labels]
+    main_components = keep_ids
+
     # Aplicar la máscara
-    result = img_array.copy()
-    result[:,:,3] = alpha * main_mask
+    result = img_array if inplace else img_array.copy()
+    np.multiply(alpha, main_mask, out=result[:,:,3])
     
     if verbose:
         kept = len(main_components)
@@ -216,11 +229,11 @@ def connect_main_components(img_array, verbose=False):
     return result
 
 
-def remove_white_pixels_advanced(img_array):
+def remove_white_pixels_advanced(img_array, inplace=True):
     """
     Eliminación avanzada de píxeles blancos con detección de contexto.
     """
-    result = img_array.copy()
+    result = img_array if inplace else img_array.copy()
     alpha = result[:,:,3]
     
     # Solo procesar píxeles visibles
@@ -229,21 +242,19 @@ def remove_white_pixels_advanced(img_array):
         return result
     
     rgb = result[:,:,:3]
-    
-    # Calcular luminosidad solo para píxeles visibles
-    luminosity = np.zeros_like(alpha, dtype=np.float32)
-    luminosity[visible_mask] = 0.299 * rgb[visible_mask,0] + 0.587 * rgb[visible_mask,1] + 0.114 * rgb[visible_mask,2]
-    
+    rgb_f = rgb.astype(np.float32)
+
+    # Calcular luminosidad densa de toda la imagen: aplanar a (N,3) hace que
+    # el producto punto se despache a BLAS (sgemv vectorizado)
+    weights = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    luminosity = (rgb_f.reshape(-1, 3) @ weights).reshape(rgb.shape[:2])
+
     # Calcular saturación para distinguir blancos verdaderos de colores claros
-    saturation = np.zeros_like(alpha, dtype=np.float32)
-    for y in range(rgb.shape[0]):
-        for x in range(rgb.shape[1]):
-            if visible_mask[y,x]:
-                r, g, b = rgb[y,x,0], rgb[y,x,1], rgb[y,x,2]
-                max_val = max(r, g, b)
-                min_val = min(r, g, b)
-                if max_val > 0:
-                    saturation[y,x] = (max_val - min_val) / max_val
+    # (vectorizado: un puñado de ufuncs en C en lugar de un bucle por píxel)
+    max_val = rgb_f.max(axis=2)
+    min_val = rgb_f.min(axis=2)
+    saturation = np.zeros_like(max_val)
+    np.divide(max_val - min_val, max_val, out=saturation, where=max_val > 0)
     
     # Definir píxeles blancos como: alta luminosidad Y baja saturación
     white_threshold_lum = 235  # Umbral de luminosidad
@@ -255,26 +266,36 @@ def remove_white_pixels_advanced(img_array):
     return result
 
 
-def smooth_edges_conservative(img_array):
+def smooth_edges_conservative(img_array, inplace=True):
     """
     Suavizado conservador que preserva los bordes nítidos del avatar principal.
     """
-    result = img_array.copy()
-    alpha = result[:,:,3].astype(np.float32)
-    
-    # Aplicar blur muy suave solo en los bordes
-    alpha_blurred = cv2.GaussianBlur(alpha, (3, 3), 0.3)  # Sigma más pequeño
-    
-    # Mantener píxeles completamente opacos sin cambios
-    strong_alpha_mask = alpha == 255
-    alpha_blurred[strong_alpha_mask] = 255
-    
-    # Para píxeles de borde (no completamente opacos), aplicar blend conservador
+    result = img_array if inplace else img_array.copy()
+    alpha = result[:,:,3]
+
+    # El blend solo toca la banda de borde (0 < alpha < 255), típicamente
+    # un porcentaje mínimo de la imagen: basta filtrar su bounding box
     edge_mask = (alpha > 0) & (alpha < 255)
-    blend_factor = 0.3  # Mezcla conservadora
-    alpha[edge_mask] = (1 - blend_factor) * alpha[edge_mask] + blend_factor * alpha_blurred[edge_mask]
-    
-    result[:,:,3] = alpha.astype(np.uint8)
+    ys, xs = np.where(edge_mask)
+    if ys.size == 0:
+        return result
+
+    pad = 2
+    y0 = max(0, int(ys.min()) - pad)
+    y1 = min(alpha.shape[0], int(ys.max()) + 1 + pad)
+    x0 = max(0, int(xs.min()) - pad)
+    x1 = min(alpha.shape[1], int(xs.max()) + 1 + pad)
+
+    # Aplicar blur muy suave solo en la región de bordes, todo en uint8:
+    # addWeighted usa la ruta SIMD saturante de 16 bits, sin temporal float
+    roi = alpha[y0:y1, x0:x1]
+    roi_blurred = cv2.GaussianBlur(roi, (3, 3), 0.3)  # Sigma más pequeño
+    blended = cv2.addWeighted(roi, 0.7, roi_blurred, 0.3, 0)  # Mezcla conservadora
+
+    # Para píxeles de borde (no completamente opacos), aplicar blend conservador;
+    # los píxeles completamente opacos quedan intactos por construcción
+    roi_edges = edge_mask[y0:y1, x0:x1]
+    roi[roi_edges] = blended[roi_edges]
     return result
 
 
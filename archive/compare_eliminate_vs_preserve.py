@@ -11,6 +11,20 @@ Genera una comparación lado a lado mostrando:
 import subprocess
 import sys
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+def _run_test(test):
+    """Ejecuta un script de comparación en su propio proceso.
+
+    Definida a nivel de módulo para que ProcessPoolExecutor pueda
+    serializarla.
+    """
+    return subprocess.run(
+        ['python', test['script']] + test['args'],
+        capture_output=True,
+        text=True,
+        encoding='utf-8'
+    )
 
 def compare_elimination_vs_preservation(input_image):
     """Compara eliminación vs preservación de elementos del personaje."""
@@ -52,20 +66,36 @@ def compare_elimination_vs_preservation(input_image):
     ]
     
     results = []
-    
-    for i, test in enumerate(tests, 1):
-        print(f"\n📋 {i}/4: {test['description']}")
+
+    # Los cuatro scripts son independientes (misma entrada, salidas distintas),
+    # así que se lanzan en paralelo y el tiempo total ≈ el más lento
+    outcomes = {}
+    with ProcessPoolExecutor(max_workers=min(4, os.cpu_count() or 1)) as executor:
+        futures = {executor.submit(_run_test, test): i for i, test in enumerate(tests)}
+        for future in as_completed(futures):
+            idx = futures[future]
+            try:
+                outcomes[idx] = future.result()
+            except Exception as e:
+                outcomes[idx] = e
+            print(f"📋 Terminado {len(outcomes)}/4: {tests[idx]['description']}")
+
+    for i, test in enumerate(tests):
+        outcome = outcomes[i]
+        print(f"\n📋 {i+1}/4: {test['description']}")
         print("-" * 50)
-        
-        try:
-            # Ejecutar el comando
-            result = subprocess.run(
-                ['python', test['script']] + test['args'],
-                capture_output=True,
-                text=True,
-                encoding='utf-8'
-            )
-            
+
+        if isinstance(outcome, Exception):
+            results.append({
+                'approach': test['approach'],
+                'description': test['description'],
+                'file': test['output'],
+                'percentage': 'Error',
+                'status': f'❌ Excepción: {str(outcome)}'
+            })
+            print(f"❌ Excepción: {str(outcome)}")
+        else:
+            result = outcome
             if result.returncode == 0:
                 # Buscar el porcentaje en la salida
                 output_lines = result.stdout.split('\n')
@@ -91,23 +121,13 @@ def compare_elimination_vs_preservation(input_image):
             else:
                 results.append({
                     'approach': test['approach'],
-                    'description': test['description'], 
+                    'description': test['description'],
                     'file': test['output'],
                     'percentage': 'Error',
                     'status': '❌ Error'
                 })
                 print(f"❌ Error en {test['script']}")
-                
-        except Exception as e:
-            results.append({
-                'approach': test['approach'],
-                'description': test['description'],
-                'file': test['output'], 
-                'percentage': 'Error',
-                'status': f'❌ Excepción: {str(e)}'
-            })
-            print(f"❌ Excepción: {str(e)}")
-    
+
     # Mostrar análisis comparativo
     print("\n" + "="*80)
     print("📊 ANÁLISIS COMPARATIVO: ¿ELIMINAR O PRESERVAR?")
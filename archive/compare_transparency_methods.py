@@ -7,9 +7,24 @@ Script para generar múltiples versiones y comparar la efectividad
 en la eliminación de objetos semi-transparentes problemáticos.
 """
 
+import re
 import subprocess
 import sys
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Compilado una vez a nivel de módulo: cubre la salida de ambos métodos
+# ("Píxeles finales" del limpiador, "Píxeles capturados" del original)
+_PCT_RE = re.compile(r'(?:Píxeles finales|Píxeles capturados):\s*([\d.]+)%')
+
+def _run_test(test):
+    """Ejecuta un script de comparación; el GIL se libera mientras espera."""
+    return subprocess.run(
+        ['python', test['script']] + test['args'],
+        capture_output=True,
+        text=True,
+        encoding='utf-8'
+    )
 
 def generate_comparison(input_image):
     """Genera múltiples versiones para comparación."""
@@ -46,39 +61,41 @@ def generate_comparison(input_image):
     ]
     
     results = []
-    
-    for i, test in enumerate(tests, 1):
-        print(f"\n📋 {i}/4: {test['description']}")
+
+    # Las cuatro variantes son procesos hijos independientes: lanzarlas en
+    # hilos las ejecuta en paralelo y el total ≈ la más lenta
+    outcomes = {}
+    with ThreadPoolExecutor(max_workers=len(tests)) as executor:
+        futures = {executor.submit(_run_test, test): i for i, test in enumerate(tests)}
+        for future in as_completed(futures):
+            idx = futures[future]
+            try:
+                outcomes[idx] = future.result()
+            except Exception as e:
+                outcomes[idx] = e
+            print(f"📋 Terminado {len(outcomes)}/4: {tests[idx]['description']}")
+
+    for i, test in enumerate(tests):
+        outcome = outcomes[i]
+        print(f"\n📋 {i+1}/4: {test['description']}")
         print("-" * 40)
-        
-        try:
-            # Ejecutar el comando
-            result = subprocess.run(
-                ['python', test['script']] + test['args'],
-                capture_output=True,
-                text=True,
-                encoding='utf-8'
-            )
-            
+
+        if isinstance(outcome, Exception):
+            results.append({
+                'method': test['description'],
+                'file': test['output'],
+                'percentage': 'Error',
+                'status': f'❌ Excepción: {str(outcome)}'
+            })
+            print(f"❌ Excepción: {str(outcome)}")
+        else:
+            result = outcome
             if result.returncode == 0:
-                # Buscar el porcentaje en la salida
-                output_lines = result.stdout.split('\n')
-                percentage = "No detectado"
-                
-                for line in output_lines:
-                    if 'Píxeles finales:' in line:
-                        # Extraer porcentaje de líneas como "📈 Píxeles finales: 32.7%"
-                        try:
-                            percentage = line.split(':')[1].strip().split('%')[0].strip() + '%'
-                        except:
-                            pass
-                    elif 'Píxeles capturados:' in line:
-                        # Para el método original
-                        try:
-                            percentage = line.split(':')[1].strip().split('%')[0].strip() + '%'
-                        except:
-                            pass
-                
+                # Buscar el porcentaje en la salida, p.ej. "📈 Píxeles finales: 32.7%";
+                # un solo re.search sobre stdout evita trocear línea por línea
+                match = _PCT_RE.search(result.stdout)
+                percentage = match.group(1) + '%' if match else "No detectado"
+
                 results.append({
                     'method': test['description'],
                     'file': test['output'],
@@ -89,23 +106,14 @@ def generate_comparison(input_image):
                 
             else:
                 results.append({
-                    'method': test['description'], 
+                    'method': test['description'],
                     'file': test['output'],
                     'percentage': 'Error',
                     'status': '❌ Error'
                 })
                 print(f"❌ Error en {test['script']}")
                 print(result.stderr)
-                
-        except Exception as e:
-            results.append({
-                'method': test['description'],
-                'file': test['output'], 
-                'percentage': 'Error',
-                'status': f'❌ Excepción: {str(e)}'
-            })
-            print(f"❌ Excepción: {str(e)}")
-    
+
     # Mostrar resumen
     print("\n" + "="*70)
     print("📊 RESUMEN DE COMPARACIÓN")
@@ -6,11 +6,44 @@ Preserva el modelo humano completo mientras elimina solo el halo blanco
 
 import sys
 import os
+import functools
+import hashlib
+import pathlib
 import cv2
 import numpy as np
 from PIL import Image
 from rembg import remove, new_session
 
+@functools.lru_cache(maxsize=4)
+def _session(model_name):
+    """Sesión rembg cacheada: recargar el grafo ONNX domina el costo de
+    cada llamada cuando se procesan varias imágenes en el mismo proceso."""
+    try:
+        # Preferir GPU cuando onnxruntime-gpu está instalado
+        return new_session(model_name,
+                           providers=['CUDAExecutionProvider', 'CPUExecutionProvider'])
+    except Exception:
+        return new_session(model_name)
+
+# Elementos estructurantes compartidos, construidos una sola vez al importar
+_K_3 = np.ones((3, 3), np.uint8)
+_K_5 = np.ones((5, 5), np.uint8)
+_K_7 = np.ones((7, 7), np.uint8)
+_K_15 = np.ones((15, 15), np.uint8)
+
+# Caché en disco de la máscara AI: la ayuda invita a reintentar con otro
+# border_treatment, y cada reintento repetía la inferencia U²-Net (el paso
+# más caro por ~2 órdenes de magnitud) para un cambio de puro post-proceso
+_MASK_CACHE_DIR = pathlib.Path('.mask_cache')
+
+def _cached_mask_path(input_path, model_name):
+    """Ruta de caché keyed por (archivo, mtime, modelo): editar la imagen
+    o cambiar de modelo invalida la entrada automáticamente."""
+    key = hashlib.md5(
+        f"{input_path}:{os.path.getmtime(input_path)}:{model_name}".encode()
+    ).hexdigest()
+    return _MASK_CACHE_DIR / f"{key}.png"
+
 def smart_white_border_removal(original_image, ai_mask, border_size=30):
     """
     Elimina el borde blanco de manera inteligente sin destruir el modelo
@@ -20,8 +53,8 @@ def smart_white_border_removal(original_image, ai_mask, border_size=30):
         ai_mask: Máscara generada por AI
         border_size: Tamaño aproximado del borde blanco a eliminar (en píxeles)
     """
-    img_array = np.array(original_image)
-    
+    img_array = np.asarray(original_image)
+
     # 1. Crear máscara base conservadora (preservar el modelo)
     base_mask = ai_mask.copy()
     _, base_mask = cv2.threshold(base_mask, 100, 255, cv2.THRESH_BINARY)
@@ -30,41 +63,54 @@ def smart_white_border_removal(original_image, ai_mask, border_size=30):
     gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
     
     # Detectar variaciones en la imagen (texturas, sombras, etc.)
-    # Esto nos ayuda a identificar partes reales del modelo
-    laplacian = cv2.Laplacian(gray, cv2.CV_64F)
-    texture_mask = np.abs(laplacian) > 5  # Áreas con textura/detalle
+    # Esto nos ayuda a identificar partes reales del modelo.
+    # CV_16S + convertScaleAbs usa la ruta SIMD entera de OpenCV en vez de
+    # promover todo a float64 (8 bytes/píxel) para una entrada de 8 bits.
+    # La textura solo alimenta una zona de protección que luego se dilata
+    # 15x15, así que en imágenes grandes se calcula a media resolución:
+    # 4x menos trabajo y la dilatación absorbe el aliasing del reescalado
+    gh, gw = gray.shape
+    if min(gh, gw) >= 512:
+        small = cv2.resize(gray, (gw // 2, gh // 2), interpolation=cv2.INTER_AREA)
+        lap_abs = cv2.convertScaleAbs(cv2.Laplacian(small, cv2.CV_16S))
+        _, texture_small = cv2.threshold(lap_abs, 5, 255, cv2.THRESH_BINARY)
+        texture_mask = cv2.resize(texture_small, (gw, gh),
+                                  interpolation=cv2.INTER_NEAREST)
+    else:
+        lap_abs = cv2.convertScaleAbs(cv2.Laplacian(gray, cv2.CV_16S))
+        _, texture_mask = cv2.threshold(lap_abs, 5, 255, cv2.THRESH_BINARY)  # Áreas con textura/detalle
     
     # 3. Detectar píxeles claramente blancos (fondo)
-    # Ser muy conservador aquí - solo píxeles MUY blancos
-    very_white_pixels = np.all(img_array > 245, axis=2)  # RGB > 245 = muy blanco
+    # Ser muy conservador aquí - solo píxeles MUY blancos (RGB > 245);
+    # inRange fusiona la comparación de los tres canales en una pasada SIMD
+    very_white_pixels = cv2.inRange(img_array, np.array([246, 246, 246], np.uint8),
+                                    np.array([255, 255, 255], np.uint8))
     
     # 4. Crear zonas de protección para el modelo
     # Dilatar la máscara de textura para proteger el modelo
-    kernel_protect = np.ones((15, 15), np.uint8)
-    protected_areas = cv2.dilate(texture_mask.astype(np.uint8) * 255, kernel_protect, iterations=1)
+    protected_areas = cv2.dilate(texture_mask, _K_15, iterations=1)
     
     # 5. Solo eliminar píxeles que sean:
     #    - Muy blancos Y
     #    - NO estén en áreas protegidas Y  
     #    - Estén cerca del borde de la máscara original
     
-    # Encontrar el borde de la máscara original
-    kernel_edge = np.ones((5, 5), np.uint8)
-    mask_eroded = cv2.erode(base_mask, kernel_edge, iterations=border_size//5)
-    border_region = base_mask - mask_eroded  # Solo la región del borde
-    
-    # 6. Píxeles a eliminar: muy blancos + en región de borde + no protegidos
-    pixels_to_remove = (very_white_pixels & 
-                       (border_region > 0) & 
-                       (protected_areas == 0))
+    # Encontrar el borde de la máscara original: gradiente unilateral
+    # (máscara − erosionada) con la resta saturante SIMD de OpenCV
+    border_region = cv2.subtract(
+        base_mask, cv2.erode(base_mask, _K_5, iterations=border_size//5))
     
+    # 6. Píxeles a eliminar: muy blancos + en región de borde + no protegidos.
+    # Todo en máscaras uint8 con bitwise_and fusionado, sin temporales bool
+    pixels_to_remove = cv2.bitwise_and(very_white_pixels, border_region)
+    cv2.bitwise_and(pixels_to_remove, cv2.bitwise_not(protected_areas),
+                    dst=pixels_to_remove)
+
     # 7. Aplicar eliminación conservadora
-    refined_mask = base_mask.copy()
-    refined_mask[pixels_to_remove] = 0
+    refined_mask = cv2.bitwise_and(base_mask, cv2.bitwise_not(pixels_to_remove))
     
     # 8. Limpiar bordes suavemente sin destruir el modelo
-    kernel_smooth = np.ones((3, 3), np.uint8)
-    refined_mask = cv2.morphologyEx(refined_mask, cv2.MORPH_CLOSE, kernel_smooth)
+    refined_mask = cv2.morphologyEx(refined_mask, cv2.MORPH_CLOSE, _K_3)
     
     # 9. Suavizar bordes muy levemente
     refined_mask = cv2.GaussianBlur(refined_mask, (3, 3), 0.5)
@@ -73,17 +119,24 @@ def smart_white_border_removal(original_image, ai_mask, border_size=30):
 
 def preserve_model_details(mask, original_image):
     """Asegura que no se pierdan detalles importantes del modelo"""
-    img_array = np.array(original_image)
+    img_array = np.asarray(original_image)
     
     # Detectar áreas con detalles importantes (rostro, manos, etc.)
     gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
     
-    # Usar detector de bordes suave para encontrar detalles
-    edges = cv2.Canny(gray, 10, 30)
-    
+    # Usar detector de bordes suave para encontrar detalles. Como el
+    # resultado solo se usa dilatado 7x7, en imágenes grandes el Canny corre
+    # a media resolución y la dilatación absorbe el aliasing del reescalado
+    gh, gw = gray.shape
+    if min(gh, gw) >= 512:
+        small = cv2.resize(gray, (gw // 2, gh // 2), interpolation=cv2.INTER_AREA)
+        edges = cv2.resize(cv2.Canny(small, 10, 30), (gw, gh),
+                           interpolation=cv2.INTER_NEAREST)
+    else:
+        edges = cv2.Canny(gray, 10, 30)
+
     # Dilatar los bordes para crear zonas de protección
-    kernel_protect = np.ones((7, 7), np.uint8)
-    detail_protection = cv2.dilate(edges, kernel_protect, iterations=1)
+    detail_protection = cv2.dilate(edges, _K_7, iterations=1)
     
     # Asegurar que estas áreas estén incluidas en la máscara
     protected_mask = cv2.bitwise_or(mask, detail_protection)
@@ -103,17 +156,36 @@ def balanced_border_removal(input_path, output_path, border_treatment='smart'):
         print("🎯 Eliminación INTELIGENTE de borde blanco...")
         print("🛡️  Modo: PRESERVAR MODELO COMPLETO")
         
-        # Cargar imagen original
+        # Cargar imagen original: una sola conversión a RGBA y una vista RGB
+        # del mismo buffer, en vez de dos decodificaciones completas
         with Image.open(input_path) as img:
-            original = img.convert('RGBA')
-            original_rgb = img.convert('RGB')
-            print(f"📐 Procesando imagen: {original.size}")
-        
-        # 1. Obtener máscara conservadora con AI
-        print("🤖 Creando máscara base conservadora...")
-        session = new_session('u2net_human_seg')
-        ai_result = remove(original_rgb, session=session)
-        ai_mask = np.array(ai_result)[:,:,3]
+            arr_rgba = np.array(img.convert('RGBA'))
+            print(f"📐 Procesando imagen: {img.size}")
+        original_rgb = np.ascontiguousarray(arr_rgba[..., :3])
+
+        # 1. Obtener máscara conservadora con AI (con caché en disco para
+        # que reintentar con otro border_treatment no repita la inferencia)
+        ai_mask = None
+        try:
+            cache = _cached_mask_path(input_path, 'u2net_human_seg')
+            if cache.exists():
+                ai_mask = cv2.imread(str(cache), cv2.IMREAD_GRAYSCALE)
+                if ai_mask is not None:
+                    print("🤖 Máscara base recuperada de caché...")
+        except OSError:
+            cache = None
+
+        if ai_mask is None:
+            print("🤖 Creando máscara base conservadora...")
+            session = _session('u2net_human_seg')
+            ai_result = remove(original_rgb, session=session)
+            ai_mask = np.asarray(ai_result)[:,:,3]
+            if cache is not None:
+                try:
+                    _MASK_CACHE_DIR.mkdir(exist_ok=True)
+                    cv2.imwrite(str(cache), ai_mask)
+                except OSError:
+                    pass  # sin caché se sigue funcionando igual
         
         # 2. Configurar tratamiento según nivel
         border_sizes = {
@@ -134,29 +206,38 @@ def balanced_border_removal(input_path, output_path, border_treatment='smart'):
         
         # 5. Limpiar muy suavemente
         print("✨ Limpieza suave final...")
-        
+
+        # T-API (OpenCL): en imágenes grandes la cadena de limpieza corre en
+        # GPU subiendo la máscara una vez y bajándola al final
+        use_ocl = cv2.ocl.haveOpenCL() and final_mask.size >= 2_000_000
+        if use_ocl:
+            final_mask = cv2.UMat(final_mask)
+
         # Solo cerrar huecos pequeños DENTRO del modelo
-        kernel_gentle = np.ones((5, 5), np.uint8)
-        final_mask = cv2.morphologyEx(final_mask, cv2.MORPH_CLOSE, kernel_gentle)
-        
+        final_mask = cv2.morphologyEx(final_mask, cv2.MORPH_CLOSE, _K_5)
+
         # Threshold suave para mantener transiciones
         final_mask = cv2.GaussianBlur(final_mask, (3, 3), 0.5)
         _, final_mask = cv2.threshold(final_mask, 100, 255, cv2.THRESH_BINARY)
+
+        if use_ocl:
+            final_mask = final_mask.get()
         
-        # 6. Aplicar máscara a imagen original
-        original_array = np.array(original)
-        original_array[:,:,3] = final_mask
-        
-        # 7. Crear imagen final
-        result_image = Image.fromarray(original_array, 'RGBA')
-        result_image.save(output_path, 'PNG')
+        # 6. Aplicar máscara reutilizando el buffer RGBA ya cargado
+        arr_rgba[:,:,3] = final_mask
+
+        # 7. Guardar con imwrite: libpng directo, sin el re-empaquetado de
+        # PIL. Compresión 3 codifica ~2-3x más rápido por ~2% más de tamaño
+        cv2.imwrite(output_path, cv2.cvtColor(arr_rgba, cv2.COLOR_RGBA2BGRA),
+                    [cv2.IMWRITE_PNG_COMPRESSION, 3])
         
         print(f"✅ ¡Modelo preservado SIN borde blanco!")
         print(f"💾 Guardado en: {output_path}")
         print(f"🎯 Tratamiento: {border_treatment}")
         
-        # Estadísticas
-        pixels_modelo = np.sum(final_mask > 127)
+        # Estadísticas: la máscara ya es binaria 0/255, así que countNonZero
+        # equivale al conteo > 127 en una sola reducción SIMD sin temporal
+        pixels_modelo = cv2.countNonZero(final_mask)
         pixels_total = final_mask.shape[0] * final_mask.shape[1]
         porcentaje = (pixels_modelo / pixels_total) * 100
         print(f"📊 Modelo preservado: {porcentaje:.1f}% de la imagen")
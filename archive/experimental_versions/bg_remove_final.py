@@ -5,50 +5,88 @@ Usage: python bg_remove_final.py input output [mode]
 """
 
 import sys
+import functools
+import cv2
 import numpy as np
 from rembg import remove, new_session
 from PIL import Image, ImageFilter, ImageOps
 import io
 
+def _preferred_providers():
+    """Accelerated providers this onnxruntime build actually ships:
+    CUDA on Linux/Windows with an NVIDIA GPU, CoreML on macOS, DirectML
+    on Windows. The model forward pass dominates total runtime, so
+    running it on a device provider is the biggest available win."""
+    try:
+        import onnxruntime as ort
+        available = ort.get_available_providers()
+    except ImportError:
+        return None
+    preferred = [p for p in ('CUDAExecutionProvider',
+                             'CoreMLExecutionProvider',
+                             'DmlExecutionProvider')
+                 if p in available]
+    if not preferred:
+        return None
+    return preferred + ['CPUExecutionProvider']
+
+# Cache ONNX sessions: new_session reloads the model weights and
+# re-initializes the runtime graph on every call, which dominates
+# latency when several images share one process
+@functools.lru_cache(maxsize=4)
+def _get_session(model_name):
+    providers = _preferred_providers()
+    if providers:
+        try:
+            return new_session(model_name, providers=providers)
+        except Exception:
+            pass
+    return new_session(model_name)
+
+# Both sharpening curves are uint8 -> uint8 maps, so they collapse into
+# 256-entry LUTs computed once at import; cv2.LUT applies them in a
+# single SIMD pass instead of the nested np.where traversals
+_BIN_LUT = ((np.arange(256) > 127).astype(np.uint8) * 255)
+_SHARP_LUT = np.clip((np.arange(256, dtype=np.int32) - 50) * 255 // (200 - 50),
+                     0, 255).astype(np.uint8)
+
 def create_sharp_mask(alpha_channel, method='threshold'):
     """
     Create sharp mask with minimal soft edges
-    
+
     Args:
         alpha_channel: PIL Image alpha channel
         method: 'threshold', 'binary', or 'enhanced'
     """
     alpha_array = np.array(alpha_channel)
-    
+
     if method == 'binary':
         # Pure binary - either fully transparent or fully opaque
-        binary_mask = np.where(alpha_array > 127, 255, 0)
-        return Image.fromarray(binary_mask.astype(np.uint8))
-    
+        return Image.fromarray(cv2.LUT(alpha_array, _BIN_LUT))
+
     elif method == 'threshold':
         # Smart threshold - preserves some anti-aliasing but reduces blur
-        threshold_high = 200
-        threshold_low = 50
-        
-        sharp_mask = np.where(alpha_array > threshold_high, 255,
-                             np.where(alpha_array < threshold_low, 0, 
-                                    (alpha_array - threshold_low) * 255 // (threshold_high - threshold_low)))
-        return Image.fromarray(sharp_mask.astype(np.uint8))
+        # (linear ramp between 50 and 200, clamped outside)
+        return Image.fromarray(cv2.LUT(alpha_array, _SHARP_LUT))
     
     elif method == 'enhanced':
-        # Enhanced processing with edge detection
-        from scipy import ndimage
-        
-        # Apply edge enhancement
-        edges = ndimage.sobel(alpha_array)
-        edge_strength = np.abs(edges)
-        
-        # Strengthen edges while preserving smooth areas
+        # Enhanced processing with edge detection: cv2.Sobel in int16
+        # replaces scipy's single-threaded sobel, and the 70th percentile
+        # comes from a cumulative histogram lookup instead of a sort
+        gx = cv2.Sobel(alpha_array, cv2.CV_16S, 1, 0, ksize=3)
+        edge_strength = cv2.convertScaleAbs(gx)
+
+        hist = cv2.calcHist([edge_strength], [0], None, [256], [0, 256])
+        cum = np.cumsum(hist)
+        edge_threshold = int(np.searchsorted(cum, 0.70 * cum[-1]))
+        edge_pixels = edge_strength > edge_threshold
+
+        # Strengthen edges while preserving smooth areas: binarize only
+        # the strong-edge pixels
         enhanced = alpha_array.copy()
-        edge_pixels = edge_strength > np.percentile(edge_strength, 70)
-        enhanced[edge_pixels] = np.where(enhanced[edge_pixels] > 127, 255, 0)
-        
-        return Image.fromarray(enhanced.astype(np.uint8))
+        enhanced[edge_pixels] = cv2.LUT(alpha_array, _BIN_LUT)[edge_pixels]
+
+        return Image.fromarray(enhanced)
     
     return alpha_channel
 
@@ -87,12 +125,9 @@ def remove_bg_ultimate(input_path, output_path, mode='sharp'):
         with open(input_path, 'rb') as f:
             input_data = f.read()
         
-        # Remove background
-        if config['model'] == 'u2net':
-            output_data = remove(input_data)
-        else:
-            session = new_session(config['model'])
-            output_data = remove(input_data, session=session)
+        # Remove background (the bare remove() call for u2net created an
+        # uncached default session on every invocation)
+        output_data = remove(input_data, session=_get_session(config['model']))
         
         # Load result
         result = Image.open(io.BytesIO(output_data)).convert("RGBA")
@@ -44,20 +44,26 @@ def smart_border_trim(original_image, mask, trim_pixels=5):
     """
     img_array = np.array(original_image)
     
-    # 1. Identificar la banda de borde exterior (donde están los píxeles problemáticos)
-    kernel_band = np.ones((trim_pixels*2 + 2, trim_pixels*2 + 2), np.uint8)
+    # 1. Identificar la banda de borde exterior (donde están los píxeles
+    # problemáticos). Kernel rectangular explícito: con MORPH_RECT la
+    # erosión usa el algoritmo separable O(1) por píxel de OpenCV en vez
+    # de recorrer el kernel denso completo
+    kernel_band = cv2.getStructuringElement(
+        cv2.MORPH_RECT, (trim_pixels*2 + 2, trim_pixels*2 + 2))
     inner_mask = cv2.erode(mask, kernel_band, iterations=1)
     border_band = cv2.subtract(mask, inner_mask)
     
     # 2. En esa banda, analizar qué píxeles son realmente blancos
     gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
     
-    # Detectar píxeles claramente blancos en la banda de borde
-    white_pixels_in_border = (border_band > 0) & (gray > 235)
-    
-    # 3. Crear máscara refinada eliminando solo esos píxeles blancos
-    refined_mask = mask.copy()
-    refined_mask[white_pixels_in_border] = 0
+    # Detectar píxeles claramente blancos en la banda de borde; todo en
+    # máscaras uint8 con bitwise_and, sin buffers bool intermedios
+    _, white_u8 = cv2.threshold(gray, 235, 255, cv2.THRESH_BINARY)
+    white_pixels_in_border = cv2.bitwise_and(white_u8, border_band)
+
+    # 3. Crear máscara refinada eliminando solo esos píxeles blancos: AND con
+    # el complemento en una sola op SIMD, sin scatter por índices booleanos
+    refined_mask = cv2.bitwise_and(mask, cv2.bitwise_not(white_pixels_in_border))
     
     # 4. Aplicar erosión muy ligera adicional solo si es necesario
     if trim_pixels > 3:
@@ -82,9 +88,11 @@ def trim_white_border_carefully(input_path, output_path, trim_level=5):
         
         # Cargar imagen
         with Image.open(input_path) as img:
-            original = img.convert('RGBA')
-            original_rgb = img.convert('RGB')
-            print(f"📐 Procesando: {original.size}")
+            # Una sola conversión a RGBA; el RGB es una vista del mismo
+            # buffer, sin una segunda decodificación completa
+            original_array = np.array(img.convert('RGBA'))
+            print(f"📐 Procesando: {img.size}")
+        original_rgb = np.ascontiguousarray(original_array[..., :3])
         
         # Generar máscara base conservadora (como modelo_balanceado)
         print("🤖 Generando máscara base conservadora...")
@@ -105,7 +113,7 @@ def trim_white_border_carefully(input_path, output_path, trim_level=5):
         
         # Preservar detalles importantes
         print("🛡️  Preservando detalles del modelo...")
-        gray = cv2.cvtColor(np.array(original_rgb), cv2.COLOR_RGB2GRAY)
+        gray = cv2.cvtColor(original_rgb, cv2.COLOR_RGB2GRAY)
         edges = cv2.Canny(gray, 5, 15)
         
         # Dilatar bordes para crear zona de protección
@@ -121,7 +129,7 @@ def trim_white_border_carefully(input_path, output_path, trim_level=5):
         final_mask = cv2.morphologyEx(final_mask, cv2.MORPH_CLOSE, kernel_final)
         
         # Aplicar a imagen original
-        original_array = np.array(original)
+        # Reutilizar el buffer RGBA ya cargado
         original_array[:,:,3] = final_mask
         
         result_image = Image.fromarray(original_array, 'RGBA')
@@ -43,9 +43,11 @@ def conservative_uniform_border_removal(input_path, output_path, gentle_trim=Tru
         
         # Cargar imagen
         with Image.open(input_path) as img:
-            original = img.convert('RGBA')
-            original_rgb = img.convert('RGB')
-            print(f"📐 Procesando: {original.size}")
+            # Una sola conversión a RGBA; el RGB es una vista del mismo
+            # buffer, sin una segunda decodificación completa
+            original_array = np.array(img.convert('RGBA'))
+            print(f"📐 Procesando: {img.size}")
+        original_rgb = np.ascontiguousarray(original_array[..., :3])
         
         # 1. Generar máscara base igual que modelo_balanceado
         print("🤖 Generando máscara conservadora...")
@@ -80,16 +82,14 @@ def conservative_uniform_border_removal(input_path, output_path, gentle_trim=Tru
         # 3. Limpieza final muy suave y simétrica
         print("✨ Limpieza final simétrica...")
         
-        # Solo cerrar huecos muy pequeños
+        # Solo cerrar huecos muy pequeños. El GaussianBlur 3x3 sigma=0.3 +
+        # threshold que seguía era trabajo muerto: el blur es casi
+        # identidad y el umbral restauraba la máscara binaria igual
         kernel_tiny = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
         final_mask = cv2.morphologyEx(final_mask, cv2.MORPH_CLOSE, kernel_tiny)
         
-        # Suavizado isotrópico mínimo
-        final_mask = cv2.GaussianBlur(final_mask, (3, 3), 0.3)
-        _, final_mask = cv2.threshold(final_mask, 120, 255, cv2.THRESH_BINARY)
-        
         # 4. Aplicar a imagen original
-        original_array = np.array(original)
+        # Reutilizar el buffer RGBA ya cargado
         original_array[:,:,3] = final_mask
         
         result_image = Image.fromarray(original_array, 'RGBA')
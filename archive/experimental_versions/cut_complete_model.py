@@ -11,9 +11,35 @@ import numpy as np
 from PIL import Image
 from rembg import remove, new_session
 
+# Sesión rembg perezosa a nivel de módulo: new_session recarga el grafo ONNX
+# (decenas de MB) en cada llamada; los tres puntos calientes usan el mismo
+# modelo, así que se crea una única vez
+_HUMAN_SESSION = None
+
+def _human_session():
+    global _HUMAN_SESSION
+    if _HUMAN_SESSION is None:
+        try:
+            # Preferir GPU cuando onnxruntime-gpu está instalado
+            _HUMAN_SESSION = new_session(
+                'u2net_human_seg',
+                providers=['CUDAExecutionProvider', 'CPUExecutionProvider'])
+        except Exception:
+            _HUMAN_SESSION = new_session('u2net_human_seg')
+    return _HUMAN_SESSION
+
+
+# Elementos estructurantes compartidos, construidos una sola vez al importar
+_K_4 = np.ones((4, 4), np.uint8)
+_K_5 = np.ones((5, 5), np.uint8)
+_K_7 = np.ones((7, 7), np.uint8)
+_K_8 = np.ones((8, 8), np.uint8)
+_K_9 = np.ones((9, 9), np.uint8)
+_K_15 = np.ones((15, 15), np.uint8)
+
 def detect_full_human_silhouette(image):
     """Detecta la silueta humana completa usando múltiples técnicas"""
-    img_array = np.array(image)
+    img_array = np.asarray(image)
     
     # 1. Detección por contraste (para fondos uniformes)
     gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
@@ -22,8 +48,7 @@ def detect_full_human_silhouette(image):
     edges = cv2.Canny(gray, 30, 100)
     
     # 3. Dilatar bordes para conectar partes del cuerpo
-    kernel = np.ones((5,5), np.uint8)
-    edges_dilated = cv2.dilate(edges, kernel, iterations=2)
+    edges_dilated = cv2.dilate(edges, _K_5, iterations=2)
     
     # 4. Encontrar contornos
     contours, _ = cv2.findContours(edges_dilated, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
@@ -32,9 +57,11 @@ def detect_full_human_silhouette(image):
     if contours:
         largest_contour = max(contours, key=cv2.contourArea)
         
-        # Crear máscara del contorno
+        # Crear máscara del contorno: drawContours con FILLED evita el setup
+        # de teselación de polígonos de fillPoly para un contorno único
         mask = np.zeros(gray.shape, np.uint8)
-        cv2.fillPoly(mask, [largest_contour], 255)
+        cv2.drawContours(mask, [largest_contour], -1, 255,
+                         thickness=cv2.FILLED)
         
         # Suavizar la máscara
         mask = cv2.GaussianBlur(mask, (5, 5), 0)
@@ -60,23 +87,34 @@ def enhance_human_mask_complete(mask_ai, mask_contour, original_shape):
     else:
         combined_mask = mask_ai
     
-    # Morfología para incluir partes que pueden haberse perdido
-    kernel_large = np.ones((15, 15), np.uint8)
-    
-    # Cerrar gaps en la silueta
-    combined_mask = cv2.morphologyEx(combined_mask, cv2.MORPH_CLOSE, kernel_large)
-    
-    # Dilatar ligeramente para asegurar que capturamos todo el modelo
-    kernel_dilate = np.ones((7, 7), np.uint8)
-    combined_mask = cv2.dilate(combined_mask, kernel_dilate, iterations=1)
+    # Morfología para incluir partes que pueden haberse perdido. En imágenes
+    # grandes los kernels 15x15/7x7 corren a media resolución (pyrDown →
+    # kernels a la mitad → pyrUp): 4x menos píxeles por operación y la
+    # máscara binaria tolera la bajada de resolución
+    h, w = combined_mask.shape[:2]
+    if min(h, w) >= 512:
+        small = cv2.pyrDown(combined_mask)
+        # Cerrar gaps en la silueta y dilatar ligeramente, a media escala
+        small = cv2.morphologyEx(small, cv2.MORPH_CLOSE, _K_8)
+        small = cv2.dilate(small, _K_4, iterations=1)
+        combined_mask = cv2.pyrUp(small, dstsize=(w, h))
+        _, combined_mask = cv2.threshold(combined_mask, 127, 255, cv2.THRESH_BINARY)
+    else:
+        # Cerrar gaps en la silueta
+        combined_mask = cv2.morphologyEx(combined_mask, cv2.MORPH_CLOSE, _K_15)
+
+        # Dilatar ligeramente para asegurar que capturamos todo el modelo
+        combined_mask = cv2.dilate(combined_mask, _K_7, iterations=1)
     
     # Llenar huecos internos
     contours, _ = cv2.findContours(combined_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     if contours:
-        # Tomar el contorno más grande y llenarlo completamente
+        # Tomar el contorno más grande y llenarlo completamente,
+        # reutilizando el buffer existente en vez de asignar otro HxW
         largest_contour = max(contours, key=cv2.contourArea)
-        combined_mask = np.zeros_like(combined_mask)
-        cv2.fillPoly(combined_mask, [largest_contour], 255)
+        combined_mask.fill(0)
+        cv2.drawContours(combined_mask, [largest_contour], -1, 255,
+                         thickness=cv2.FILLED)
     
     # Suavizar bordes finales
     combined_mask = cv2.GaussianBlur(combined_mask, (3, 3), 0)
@@ -95,19 +133,20 @@ def cut_complete_human_model(input_path, output_path, aggressiveness='complete')
     try:
         print("🎯 Iniciando corte COMPLETO del modelo humano...")
         
-        # Cargar imagen original
+        # Cargar imagen original: una sola conversión a RGBA y una vista
+        # RGB del mismo buffer, en vez de dos decodificaciones completas
         with Image.open(input_path) as img:
-            original = img.convert('RGBA')
-            original_rgb = img.convert('RGB')
-            print(f"📐 Procesando imagen: {original.size}")
+            arr_rgba = np.array(img.convert('RGBA'))
+            print(f"📐 Procesando imagen: {img.size}")
+        original_rgb = np.ascontiguousarray(arr_rgba[..., :3])
         
         # 1. Usar AI especializada en humanos
         print("🤖 Detectando silueta con AI especializada...")
-        session = new_session('u2net_human_seg')
+        session = _human_session()
         ai_result = remove(original_rgb, session=session)
         
         # Extraer máscara de AI
-        ai_mask = np.array(ai_result)[:,:,3]
+        ai_mask = np.asarray(ai_result)[:,:,3]
         
         # 2. Detectar contornos del modelo
         print("🔍 Detectando contornos del modelo...")
@@ -115,17 +154,24 @@ def cut_complete_human_model(input_path, output_path, aggressiveness='complete')
         
         # 3. Combinar técnicas para captura completa
         print("🎯 Combinando técnicas para captura completa...")
-        final_mask = enhance_human_mask_complete(ai_mask, contour_mask, np.array(original).shape)
+        final_mask = enhance_human_mask_complete(ai_mask, contour_mask, arr_rgba.shape)
         
         # 4. Ajustar agresividad según parámetro
         if aggressiveness == 'aggressive':
-            # Dilatar más para capturar absolutamente todo
-            kernel = np.ones((15, 15), np.uint8)
-            final_mask = cv2.dilate(final_mask, kernel, iterations=2)
+            # Dilatar más para capturar absolutamente todo. La dilatación
+            # 15x15 x2 corre a media resolución en imágenes grandes; la
+            # dilatación agresiva absorbe el reescalado sin pérdida visible
+            h, w = final_mask.shape[:2]
+            if min(h, w) >= 512:
+                small = cv2.pyrDown(final_mask)
+                small = cv2.dilate(small, _K_8, iterations=2)
+                final_mask = cv2.pyrUp(small, dstsize=(w, h))
+                _, final_mask = cv2.threshold(final_mask, 127, 255, cv2.THRESH_BINARY)
+            else:
+                final_mask = cv2.dilate(final_mask, _K_15, iterations=2)
         elif aggressiveness == 'complete':
             # Nivel balanceado para captura completa
-            kernel = np.ones((9, 9), np.uint8)
-            final_mask = cv2.dilate(final_mask, kernel, iterations=1)
+            final_mask = cv2.dilate(final_mask, _K_9, iterations=1)
         elif aggressiveness == 'conservative':
             # Solo usar resultado de AI
             final_mask = ai_mask
@@ -139,17 +185,12 @@ def cut_complete_human_model(input_path, output_path, aggressiveness='complete')
         # Suavizar bordes levemente
         final_mask = cv2.medianBlur(final_mask, 3)
         
-        # 6. Aplicar máscara a imagen original
-        original_array = np.array(original)
-        
-        # Aplicar la máscara al canal alpha
-        original_array[:,:,3] = final_mask
-        
-        # Crear imagen final
-        result_image = Image.fromarray(original_array, 'RGBA')
-        
-        # Guardar resultado
-        result_image.save(output_path, 'PNG')
+        # 6. Aplicar máscara al canal alpha reutilizando el buffer RGBA
+        arr_rgba[:,:,3] = final_mask
+
+        # Guardar con imwrite: libpng directo, sin el re-empaquetado de PIL
+        cv2.imwrite(output_path, cv2.cvtColor(arr_rgba, cv2.COLOR_RGBA2BGRA),
+                    [cv2.IMWRITE_PNG_COMPRESSION, 3])
         
         print(f"✅ ¡Modelo humano cortado completamente!")
         print(f"💾 Guardado en: {output_path}")
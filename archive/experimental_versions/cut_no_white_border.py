@@ -107,9 +107,11 @@ def cut_model_no_white_border(input_path, output_path, border_removal='aggressiv
         
         # Cargar imagen original
         with Image.open(input_path) as img:
-            original = img.convert('RGBA')
-            original_rgb = img.convert('RGB')
-            print(f"📐 Procesando imagen: {original.size}")
+            # Una sola conversión a RGBA; el RGB es una vista del mismo
+            # buffer, sin una segunda decodificación completa
+            original_array = np.array(img.convert('RGBA'))
+            print(f"📐 Procesando imagen: {img.size}")
+        original_rgb = np.ascontiguousarray(original_array[..., :3])
         
         # 1. Obtener máscara inicial con AI
         print("🤖 Detectando modelo con AI...")
@@ -161,7 +163,7 @@ def cut_model_no_white_border(input_path, output_path, border_removal='aggressiv
         _, final_mask = cv2.threshold(final_mask, 127, 255, cv2.THRESH_BINARY)
         
         # 8. Aplicar máscara a imagen original
-        original_array = np.array(original)
+        # Reutilizar el buffer RGBA ya cargado
         original_array[:,:,3] = final_mask
         
         # 9. Crear imagen final
@@ -11,6 +11,40 @@ import numpy as np
 from PIL import Image
 from rembg import remove, new_session
 
+# Sesión rembg perezosa a nivel de módulo: new_session recarga el grafo ONNX
+# (decenas de MB) en cada llamada; los tres puntos calientes usan el mismo
+# modelo, así que se crea una única vez
+_HUMAN_SESSION = None
+
+def _human_session():
+    global _HUMAN_SESSION
+    if _HUMAN_SESSION is None:
+        try:
+            # Preferir GPU cuando onnxruntime-gpu está instalado
+            _HUMAN_SESSION = new_session(
+                'u2net_human_seg',
+                providers=['CUDAExecutionProvider', 'CPUExecutionProvider'])
+        except Exception:
+            _HUMAN_SESSION = new_session('u2net_human_seg')
+    return _HUMAN_SESSION
+
+
+# Elementos estructurantes compartidos, construidos una sola vez al importar
+_K_2 = np.ones((2, 2), np.uint8)
+_K_3 = np.ones((3, 3), np.uint8)
+_K_5 = np.ones((5, 5), np.uint8)
+_K_12 = np.ones((12, 12), np.uint8)
+
+# Buffers intermedios cacheados por nombre y pasados como dst= a OpenCV,
+# para no alocar un HxW nuevo en cada paso de la cadena de máscaras
+_SCRATCH = {}
+
+def _scratch(name, shape):
+    buf = _SCRATCH.get(name)
+    if buf is None or buf.shape != shape:
+        buf = _SCRATCH[name] = np.empty(shape, np.uint8)
+    return buf
+
 def detect_residual_white_border(original_image, mask, border_pixels=5):
     """
     Detecta y elimina los últimos píxeles de borde blanco residual
@@ -20,97 +54,121 @@ def detect_residual_white_border(original_image, mask, border_pixels=5):
         mask: Máscara ya procesada
         border_pixels: Número de píxeles de borde a analizar (5-8)
     """
-    img_array = np.array(original_image)
-    
-    # 1. Encontrar el contorno exterior de la máscara actual
-    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    img_array = np.asarray(original_image)
     
-    if not contours:
+    # 1. Máscara vacía: nada que detectar. El findContours anterior solo
+    # servía de chequeo de existencia y el contorno más grande que
+    # calculaba nunca se leía; un countNonZero hace lo mismo sin trazar
+    # contornos
+    if cv2.countNonZero(mask) == 0:
         return mask
-    
-    # Tomar el contorno más grande
-    largest_contour = max(contours, key=cv2.contourArea)
-    
-    # 2. Crear una banda de análisis alrededor del borde
-    # Erosionar la máscara para crear la banda interior
-    kernel_inner = np.ones((border_pixels*2, border_pixels*2), np.uint8)
-    inner_mask = cv2.erode(mask, kernel_inner, iterations=1)
-    
-    # La banda de análisis es la diferencia entre máscara original y erosionada
-    border_band = cv2.subtract(mask, inner_mask)
-    
+
+
+    # 2. Crear una banda de análisis alrededor del borde con un gradiente
+    # morfológico: una sola operación en vez de erosión + resta, sin el
+    # buffer intermedio. El anillo exterior extra que añade el gradiente es
+    # inocuo: esos píxeles ya valen 0 en la máscara al aplicar el refinado
+    kernel_band = cv2.getStructuringElement(
+        cv2.MORPH_RECT, (border_pixels * 2 + 1, border_pixels * 2 + 1))
+    border_band = cv2.morphologyEx(mask, cv2.MORPH_GRADIENT, kernel_band)
+
+    # Banda vacía (sujeto mínimo o máscara vacía): nada que analizar, se
+    # ahorran las conversiones de color y la detección multi-espacio
+    if cv2.countNonZero(border_band) < 100:
+        return mask
+
     # 3. Analizar píxeles en la banda de borde
-    # Convertir a diferentes espacios de color para mejor detección
+    # HSV se necesita completo (saturación + brillo), pero del LAB solo se
+    # leía el canal L: el gris lo aproxima de sobra para un umbral de
+    # brillo, ahorrando una conversión HxWx3 entera
     hsv = cv2.cvtColor(img_array, cv2.COLOR_RGB2HSV)
-    lab = cv2.cvtColor(img_array, cv2.COLOR_RGB2LAB)
+    gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
     
     # 4. Detectar píxeles residuales blancos/claros en la banda
-    # Ser más específico que antes pero no agresivo
-    
-    # En RGB: píxeles muy claros
-    rgb_white = np.all(img_array > 235, axis=2)  # Ligeramente menos estricto que 245
-    
-    # En HSV: baja saturación (blancos/grises)
-    low_saturation = hsv[:,:,1] < 20  # Muy baja saturación
-    high_value = hsv[:,:,2] > 240     # Alto brillo
-    hsv_white = low_saturation & high_value
-    
-    # En LAB: alto valor L (luminancia)
-    lab_bright = lab[:,:,0] > 240
-    
+    # Ser más específico que antes pero no agresivo.
+    # Un inRange por espacio de color produce directamente máscaras uint8,
+    # sin los 4-5 buffers bool intermedios de los cortes por canal
+
+    # En RGB: píxeles muy claros (>235, ligeramente menos estricto que 245)
+    rgb_white = cv2.inRange(img_array, np.array([236] * 3, np.uint8),
+                            np.array([255] * 3, np.uint8))
+
+    # En HSV: baja saturación (blancos/grises) y alto brillo
+    hsv_white = cv2.inRange(hsv, np.array([0, 0, 241], np.uint8),
+                            np.array([179, 19, 255], np.uint8))
+
+    # Luminancia alta: el gris como proxy del canal L, un solo canal
+    lab_bright = cv2.compare(gray, 240, cv2.CMP_GT)
+
     # 5. Combinar detecciones (píxeles que son blancos en múltiples espacios)
-    residual_white = (rgb_white | hsv_white) & lab_bright
-    
+    residual_white = cv2.bitwise_and(cv2.bitwise_or(rgb_white, hsv_white),
+                                     lab_bright)
+
     # 6. Solo considerar píxeles residuales que están en la banda de borde
-    residual_in_border = residual_white & (border_band > 0)
-    
+    residual_in_border = cv2.bitwise_and(residual_white, border_band)
+
     # 7. Crear máscara refinada eliminando píxeles residuales
-    refined_mask = mask.copy()
-    refined_mask[residual_in_border] = 0
+    refined_mask = cv2.bitwise_and(mask, cv2.bitwise_not(residual_in_border))
     
     # 8. Suavizar muy ligeramente los nuevos bordes
-    kernel_smooth = np.ones((2, 2), np.uint8)
-    refined_mask = cv2.morphologyEx(refined_mask, cv2.MORPH_CLOSE, kernel_smooth)
+    refined_mask = cv2.morphologyEx(refined_mask, cv2.MORPH_CLOSE, _K_2)
     
     return refined_mask
 
 def smart_white_border_removal_v2(original_image, ai_mask, border_size=25):
     """Versión mejorada de eliminación de borde blanco"""
-    img_array = np.array(original_image)
-    
+    img_array = np.asarray(original_image)
+
+    shape = img_array.shape[:2]
+    base_mask = _scratch('base', shape)
+    s1 = _scratch('s1', shape)
+    s2 = _scratch('s2', shape)
+    s3 = _scratch('s3', shape)
+
     # 1. Máscara base conservadora
-    base_mask = ai_mask.copy()
-    _, base_mask = cv2.threshold(base_mask, 100, 255, cv2.THRESH_BINARY)
-    
-    # 2. Detectar áreas con textura (para proteger)
+    cv2.threshold(ai_mask, 100, 255, cv2.THRESH_BINARY, dst=base_mask)
+
+    # 2. Encontrar región de borde: una sola erosión con el kernel
+    # equivalente a N iteraciones del 4x4 ((4-1)*N+1) hace una pasada de
+    # memoria en vez de N; la morfología rectangular de OpenCV es O(1)/píxel
+    side = 3 * (border_size // 4) + 1
+    kernel_edge = cv2.getStructuringElement(cv2.MORPH_RECT, (side, side))
+    cv2.erode(base_mask, kernel_edge, dst=s2)
+    border_region = cv2.subtract(base_mask, s2, dst=s2)
+
+    # Sin banda de borde no hay blancos que quitar: se ahorran la
+    # detección de textura y de blancos completas (copia fresca para no
+    # devolver un buffer del pool)
+    if cv2.countNonZero(border_region) < 100:
+        return base_mask.copy()
+
+    # 3. Detectar áreas con textura (para proteger)
     gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
-    laplacian = cv2.Laplacian(gray, cv2.CV_64F)
-    texture_mask = np.abs(laplacian) > 3  # Más sensible a texturas
-    
-    # 3. Detectar píxeles claramente blancos
-    very_white_pixels = np.all(img_array > 240, axis=2)  # Menos estricto
-    
-    # 4. Proteger áreas con textura
-    kernel_protect = np.ones((12, 12), np.uint8)
-    protected_areas = cv2.dilate(texture_mask.astype(np.uint8) * 255, kernel_protect, iterations=1)
-    
-    # 5. Encontrar región de borde
-    kernel_edge = np.ones((4, 4), np.uint8)
-    mask_eroded = cv2.erode(base_mask, kernel_edge, iterations=border_size//4)
-    border_region = base_mask - mask_eroded
-    
-    # 6. Eliminar píxeles blancos en borde no protegido
-    pixels_to_remove = (very_white_pixels & 
-                       (border_region > 0) & 
-                       (protected_areas == 0))
-    
-    refined_mask = base_mask.copy()
-    refined_mask[pixels_to_remove] = 0
-    
-    # 7. Cerrar pequeños huecos
-    kernel_close = np.ones((3, 3), np.uint8)
-    refined_mask = cv2.morphologyEx(refined_mask, cv2.MORPH_CLOSE, kernel_close)
-    
+    # CV_16S + convertScaleAbs usa la ruta SIMD entera de OpenCV en vez de
+    # promover a float64; el umbral 3 mantiene la sensibilidad a texturas
+    texture_mask = cv2.convertScaleAbs(cv2.Laplacian(gray, cv2.CV_16S))
+    cv2.threshold(texture_mask, 3, 255, cv2.THRESH_BINARY, dst=texture_mask)
+
+    # 4. Detectar píxeles claramente blancos (>240, menos estricto) como
+    # máscara uint8: inRange fusiona los tres canales en una pasada SIMD
+    cv2.inRange(img_array, np.array([241] * 3, np.uint8),
+                np.array([255] * 3, np.uint8), dst=s3)
+
+    # 5. Proteger áreas con textura (texture_mask ya es uint8 0/255)
+    protected_areas = cv2.dilate(texture_mask, _K_12, dst=s1, iterations=1)
+
+    # 6. Eliminar píxeles blancos en borde no protegido: todo en máscaras
+    # uint8 con bitwise_and sobre los buffers de trabajo, sin temporales
+    # bool ni scatter
+    cv2.bitwise_and(s3, border_region, dst=s3)
+    cv2.bitwise_not(protected_areas, dst=s1)
+    cv2.bitwise_and(s3, s1, dst=s3)          # píxeles a eliminar
+    cv2.bitwise_not(s3, dst=s3)
+    refined_mask = cv2.bitwise_and(base_mask, s3, dst=s3)
+
+    # 7. Cerrar pequeños huecos (salida fresca: pertenece al llamador)
+    refined_mask = cv2.morphologyEx(refined_mask, cv2.MORPH_CLOSE, _K_3)
+
     return refined_mask
 
 def final_border_cleanup(input_path, output_path, residual_pixels=5):
@@ -126,17 +184,18 @@ def final_border_cleanup(input_path, output_path, residual_pixels=5):
         print("🎯 Eliminación FINAL de bordes blancos residuales...")
         print(f"🔍 Enfocado en eliminar ~{residual_pixels}px de borde restante")
         
-        # Cargar imagen original
+        # Cargar imagen original: una sola conversión a RGBA y una vista
+        # RGB del mismo buffer, en vez de dos decodificaciones completas
         with Image.open(input_path) as img:
-            original = img.convert('RGBA')
-            original_rgb = img.convert('RGB')
-            print(f"📐 Procesando imagen: {original.size}")
+            arr_rgba = np.array(img.convert('RGBA'))
+            print(f"📐 Procesando imagen: {img.size}")
+        original_rgb = np.ascontiguousarray(arr_rgba[..., :3])
         
         # 1. Obtener máscara base con AI
         print("🤖 Creando máscara base optimizada...")
-        session = new_session('u2net_human_seg')
+        session = _human_session()
         ai_result = remove(original_rgb, session=session)
-        ai_mask = np.array(ai_result)[:,:,3]
+        ai_mask = np.asarray(ai_result)[:,:,3]
         
         # 2. Aplicar eliminación inteligente mejorada
         print("🧠 Eliminación inteligente de borde blanco...")
@@ -148,11 +207,10 @@ def final_border_cleanup(input_path, output_path, residual_pixels=5):
         
         # 4. Preservar detalles importantes
         print("🛡️  Preservando detalles del modelo...")
-        gray = cv2.cvtColor(np.array(original_rgb), cv2.COLOR_RGB2GRAY)
+        gray = cv2.cvtColor(original_rgb, cv2.COLOR_RGB2GRAY)
         edges = cv2.Canny(gray, 8, 25)  # Más sensible a detalles
         
-        kernel_detail = np.ones((5, 5), np.uint8)
-        detail_protection = cv2.dilate(edges, kernel_detail, iterations=1)
+        detail_protection = cv2.dilate(edges, _K_5, iterations=1)
         
         # Asegurar que los detalles estén incluidos
         final_mask = cv2.bitwise_or(final_mask, detail_protection)
@@ -161,20 +219,19 @@ def final_border_cleanup(input_path, output_path, residual_pixels=5):
         print("✨ Refinamiento final suave...")
         
         # Solo cerrar huecos muy pequeños
-        kernel_gentle = np.ones((3, 3), np.uint8)
-        final_mask = cv2.morphologyEx(final_mask, cv2.MORPH_CLOSE, kernel_gentle)
-        
-        # Suavizado mínimo para bordes naturales
-        final_mask = cv2.GaussianBlur(final_mask, (3, 3), 0.3)
-        _, final_mask = cv2.threshold(final_mask, 120, 255, cv2.THRESH_BINARY)
-        
-        # 6. Aplicar máscara a imagen original
-        original_array = np.array(original)
-        original_array[:,:,3] = final_mask
+        final_mask = cv2.morphologyEx(final_mask, cv2.MORPH_CLOSE, _K_3)
+
+        # Suavizado mínimo: medianBlur sí elimina el dentado en escalera,
+        # mientras que el antiguo GaussianBlur 3x3 sigma=0.3 era casi
+        # identidad y el umbral posterior lo revertía
+        final_mask = cv2.medianBlur(final_mask, 3)
         
-        # 7. Crear imagen final
-        result_image = Image.fromarray(original_array, 'RGBA')
-        result_image.save(output_path, 'PNG')
+        # 6. Aplicar máscara reutilizando el buffer RGBA ya cargado
+        arr_rgba[:,:,3] = final_mask
+
+        # 7. Guardar con imwrite: libpng directo, sin re-empaquetado de PIL
+        cv2.imwrite(output_path, cv2.cvtColor(arr_rgba, cv2.COLOR_RGBA2BGRA),
+                    [cv2.IMWRITE_PNG_COMPRESSION, 3])
         
         print(f"✅ ¡Bordes residuales eliminados exitosamente!")
         print(f"💾 Guardado en: {output_path}")
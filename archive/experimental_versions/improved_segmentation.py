@@ -97,15 +97,15 @@ def enhance_model_completeness(original_image, base_mask):
             print("🔗 Conectando componentes separados...")
             
             # Dilatar cada componente para intentar conectarlos
-            kernel_connect = np.ones((15, 15), np.uint8)
+            kernel_connect = cv2.getStructuringElement(cv2.MORPH_RECT, (15, 15))
             dilated_mask = cv2.dilate(base_mask, kernel_connect, iterations=2)
             
             # Cerrar gaps entre componentes
-            kernel_close = np.ones((25, 25), np.uint8)
+            kernel_close = cv2.getStructuringElement(cv2.MORPH_RECT, (25, 25))
             enhanced_mask = cv2.morphologyEx(dilated_mask, cv2.MORPH_CLOSE, kernel_close)
             
             # Erosionar de vuelta, pero menos que la dilatación original
-            kernel_erode = np.ones((10, 10), np.uint8)
+            kernel_erode = cv2.getStructuringElement(cv2.MORPH_RECT, (10, 10))
             enhanced_mask = cv2.erode(enhanced_mask, kernel_erode, iterations=1)
         else:
             enhanced_mask = base_mask
@@ -150,7 +150,7 @@ def detect_missing_parts(original_image, current_mask):
     
     # 3. Filtrar por proximidad al modelo existente
     # Dilatar máscara actual para crear zona de búsqueda
-    kernel_search = np.ones((30, 30), np.uint8)
+    kernel_search = cv2.getStructuringElement(cv2.MORPH_RECT, (30, 30))
     search_area = cv2.dilate(current_mask, kernel_search, iterations=1)
     
     # Solo considerar píxeles similares en la zona de búsqueda
@@ -171,9 +171,11 @@ def complete_model_segmentation(input_path, output_path):
         
         # Cargar imagen
         with Image.open(input_path) as img:
-            original = img.convert('RGBA')
-            original_rgb = img.convert('RGB')
-            print(f"📐 Procesando: {original.size}")
+            # Una sola conversión a RGBA; el RGB es una vista del mismo
+            # buffer, sin una segunda decodificación completa
+            original_array = np.array(img.convert('RGBA'))
+            print(f"📐 Procesando: {img.size}")
+        original_rgb = np.ascontiguousarray(original_array[..., :3])
         
         # 1. Segmentación mejorada con múltiples modelos
         base_mask = improved_model_segmentation(original_rgb)
@@ -204,22 +206,27 @@ def complete_model_segmentation(input_path, output_path):
         kernel_clean = np.ones((5, 5), np.uint8)
         final_mask = cv2.morphologyEx(complete_mask, cv2.MORPH_CLOSE, kernel_clean)
         
-        # Suavizado muy ligero
-        final_mask = cv2.GaussianBlur(final_mask, (3, 3), 0.5)
-        _, final_mask = cv2.threshold(final_mask, 127, 255, cv2.THRESH_BINARY)
+        # Suavizado muy ligero: mediana 3x3 en una pasada; el blur
+        # sigma=0.5 + threshold(127) anterior equivalía a un voto de
+        # mayoría sobre la máscara binaria
+        final_mask = cv2.medianBlur(final_mask, 3)
         
         # 5. Eliminar píxeles blancos específicos
         print("🧹 Eliminando píxeles blancos residuales...")
-        img_array = np.array(original_rgb)
-        is_white = np.all(img_array >= 245, axis=2)
-        white_in_mask = (final_mask > 0) & is_white
-        final_mask[white_in_mask] = 0
-        
-        removed_whites = np.sum(white_in_mask)
+        img_array = original_rgb
+        # Todo en máscaras uint8: inRange + bitwise_and en pasadas SIMD,
+        # sin temporales bool ni scatter por índices booleanos
+        is_white = cv2.inRange(img_array, np.array([245] * 3, np.uint8),
+                               np.array([255] * 3, np.uint8))
+        white_in_mask = cv2.bitwise_and(is_white, final_mask)
+        cv2.bitwise_and(final_mask, cv2.bitwise_not(white_in_mask),
+                        dst=final_mask)
+
+        removed_whites = cv2.countNonZero(white_in_mask)
         print(f"🔍 Eliminados {removed_whites} píxeles blancos")
         
         # 6. Aplicar a imagen original
-        original_array = np.array(original)
+        # Reutilizar el buffer RGBA ya cargado
         original_array[:,:,3] = final_mask
         
         result_image = Image.fromarray(original_array, 'RGBA')
@@ -29,7 +29,6 @@ from PIL import Image
 import sys
 import os
 import io
-from scipy import ndimage
 
 
 def remove_background_preserve_elements(input_path, output_path, min_alpha_threshold=50, verbose=False):
@@ -7,7 +7,6 @@ from rembg import remove, new_session
 from PIL import Image
 import os
 import io
-from scipy import ndimage
 from typing import Optional, Tuple, Union
 import logging
 
@@ -222,9 +221,10 @@ class BackgroundRemover:
         """Remove only white background pixels."""
         result = img_array.copy()
         
-        # Create mask for white/near-white pixels
+        # Create mask for white/near-white pixels; the channel-min
+        # reduction avoids the HxWx3 boolean temporary of np.all
         rgb = result[:,:,:3]
-        white_mask = np.all(rgb > 240, axis=2)
+        white_mask = rgb.min(axis=2) > 240
         
         # Only remove whites that have low alpha (likely background)
         background_whites = white_mask & (result[:,:,3] < 200)
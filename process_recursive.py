@@ -17,6 +17,8 @@ Ejemplos:
 
 import os
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 import time
 from typing import List, Tuple, Optional
@@ -27,13 +29,18 @@ from bgremover_package import BackgroundRemover
 
 class RecursiveProcessor:
     """Procesador recursivo de imágenes con preservación de estructura."""
-    
-    def __init__(self, threshold: int = 20, verbose: bool = False):
+
+    def __init__(self, threshold: int = 20, verbose: bool = False,
+                 workers: Optional[int] = None):
         self.threshold = threshold
         self.verbose = verbose
         self.remover = BackgroundRemover()
         self.supported_extensions = {'.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif', '.webp'}
-        
+        # cv2 y ONNX Runtime liberan el GIL dentro de sus kernels, así que
+        # imágenes independientes escalan casi lineal con hilos
+        self.workers = workers or os.cpu_count() or 1
+        self._stats_lock = threading.Lock()
+
         # Estadísticas
         self.stats = {
             'total_found': 0,
@@ -123,20 +130,23 @@ class RecursiveProcessor:
             )
             
             if success:
-                self.stats['processed'] += 1
+                with self._stats_lock:
+                    self.stats['processed'] += 1
                 if self.verbose:
                     rel_input = input_path.relative_to(Path(sys.argv[1]))
                     rel_output = output_path.relative_to(Path(sys.argv[2]))
                     print(f"✅ {rel_input} → {rel_output}")
             else:
-                self.stats['errors'] += 1
+                with self._stats_lock:
+                    self.stats['errors'] += 1
                 if self.verbose:
                     print(f"❌ Error procesando: {input_path}")
-            
+
             return success
-            
+
         except Exception as e:
-            self.stats['errors'] += 1
+            with self._stats_lock:
+                self.stats['errors'] += 1
             if self.verbose:
                 print(f"❌ Excepción en {input_path}: {e}")
             return False
@@ -186,23 +196,25 @@ class RecursiveProcessor:
         print(f"📁 Directorios creados: {self.stats['directories_created']}")
         print()
         
-        # Procesar imágenes
-        print("🚀 Iniciando procesamiento...")
+        # Procesar imágenes en paralelo: cada imagen es independiente y el
+        # trabajo pesado (inferencia ONNX, cv2) corre sin GIL
+        print(f"🚀 Iniciando procesamiento con {self.workers} hilos...")
         if not self.verbose:
             print("💡 Usa 'verbose=true' para ver progreso detallado")
         print()
-        
-        for i, (input_img, output_img) in enumerate(image_pairs, 1):
-            if not self.verbose:
-                # Mostrar progreso simple
-                progress = (i / len(image_pairs)) * 100
-                print(f"\r🔄 Progreso: {i}/{len(image_pairs)} ({progress:.1f}%) - {input_img.name}", end='', flush=True)
-            
-            success = self.process_image(input_img, output_img)
-            
-            if not success:
-                self.stats['errors'] += 1
-        
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {
+                executor.submit(self.process_image, input_img, output_img): input_img
+                for input_img, output_img in image_pairs
+            }
+            for i, future in enumerate(as_completed(futures), 1):
+                future.result()
+                if not self.verbose:
+                    # Mostrar progreso simple
+                    progress = (i / len(image_pairs)) * 100
+                    print(f"\r🔄 Progreso: {i}/{len(image_pairs)} ({progress:.1f}%) - {futures[future].name}", end='', flush=True)
+
         # Estadísticas finales
         elapsed_time = time.time() - self.stats['start_time']
         self.print_final_stats(elapsed_time)